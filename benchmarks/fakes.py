@@ -0,0 +1,103 @@
+"""Local stand-ins for yahoo, discord and S3 so the cog can be timed without the network"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import yfinance
+
+
+class FakeYahoo:
+    """Generates one minute random walk bars ending now for any ticker, after sleeping latency seconds per call
+    like a download would. install() swaps it in for yf.download and yf.Ticker."""
+
+    def __init__(self, latency: float = 0.0, bars: int = 60, seed: int = 0):
+        self.latency = latency
+        self.bars = bars
+        self.rng = np.random.default_rng(seed)
+        self.calls = 0
+
+    def install(self):
+        yfinance.download = self.download
+        yfinance.Ticker = lambda symbol: FakeTicker(self, symbol)
+
+    def frame(self) -> pd.DataFrame:
+        end = pd.Timestamp.now(tz='UTC').floor('min')
+        index = pd.date_range(end=end, periods=self.bars, freq='1min', name='Datetime')
+        close = 100 * np.exp(np.cumsum(self.rng.normal(0, 0.002, self.bars)))
+        return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Adj Close': close,
+                             'Volume': np.zeros(self.bars, dtype=np.int64)}, index=index)
+
+    def download(self, tickers: str, group_by: str = 'column', **kwargs) -> pd.DataFrame:
+        self.calls += 1
+        time.sleep(self.latency)
+        symbols = tickers.split()
+        if len(symbols) == 1:
+            return self.frame()
+        return pd.concat({symbol: self.frame() for symbol in symbols}, axis=1)
+
+
+class FakeTicker:
+    def __init__(self, yahoo: FakeYahoo, symbol: str):
+        self.yahoo = yahoo
+        self.symbol = symbol
+
+    def history(self, **kwargs) -> pd.DataFrame:
+        return self.yahoo.download(self.symbol)
+
+
+class RecordingChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.messages: List[dict] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        self.messages.append(dict(kwargs, content=content))
+
+
+class FakeHTTP:
+    """Takes the raw message posts the notifier makes and records them on the channel they were sent to"""
+
+    def __init__(self, bot: 'FakeBot'):
+        self.bot = bot
+        self.requests = 0
+
+    async def request(self, route, **kwargs):
+        self.requests += 1
+        await self.bot.get_channel(route.channel_id).send(**kwargs.get('json', {}))
+
+
+class FakeBot:
+    user = 'benchmark'
+
+    def __init__(self):
+        self.loop = asyncio.get_event_loop()
+        self.channels: Dict[int, RecordingChannel] = {}
+        self.http = FakeHTTP(self)
+
+    def get_channel(self, channel_id: int) -> RecordingChannel:
+        if channel_id not in self.channels:
+            self.channels[channel_id] = RecordingChannel(channel_id)
+        return self.channels[channel_id]
+
+    @property
+    def messages(self) -> int:
+        return sum(len(channel.messages) for channel in self.channels.values())
+
+
+class FakeContext:
+    """What the commands use of a SlashContext"""
+
+    def __init__(self, guild_id: int, channel_id: int, author_id: int = 1):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.sent: List[dict] = []
+        self.deferred = False
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        self.sent.append(dict(kwargs, content=content))
+
+    async def defer(self, **kwargs):
+        self.deferred = True
@@ -0,0 +1,173 @@
+"""Times the cog's hot paths against local fakes for yahoo, discord and S3.
+
+    python -m benchmarks.run --sizes 10 1000 10000 100000 --latency 0.05 --output benchmarks/results.json
+
+Each size is the number of alerts and of trades in the book. Results are written as a json list of
+{"benchmark", "size", "repeat", "min", "median", "mean"} records, times in seconds.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+os.environ.setdefault('STORAGE', 'memory')
+os.environ.setdefault('SAVE_DELAY', '3600')  # uploads are timed through save/load, not left to the debouncer
+
+from benchmarks.fakes import FakeBot, FakeContext, FakeYahoo
+from cogs.Stocks import Alert, GUILD_IDS, Stocks, Trade
+from cogs.utils.cache import price_cache
+from cogs.utils.portfolio import Portfolio
+from cogs.utils.registry import AlertRegistry
+from cogs.utils.scheduler import PollScheduler
+
+CHANNEL_ID = 1
+
+
+async def measure(name: str, size: int, func: Callable, repeat: int, setup: Optional[Callable] = None) -> dict:
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            result = setup()
+            if inspect.isawaitable(result):
+                await result
+        start = time.perf_counter()
+        result = func()
+        if inspect.isawaitable(result):
+            await result
+        times.append(time.perf_counter() - start)
+    record = {'benchmark': name, 'size': size, 'repeat': repeat,
+              'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times)}
+    print(f'{name:>14} {size:>7}  median {record["median"] * 1000:10.3f}ms  min {record["min"] * 1000:10.3f}ms')
+    return record
+
+
+def make_book(cog: Stocks, size: int, seed: int = 0):
+    """Give the cog size alerts and size trades over up to 1000 always open (crypto) tickers, stored as
+    snapshots in its storage"""
+    rng = np.random.default_rng(seed)
+    tickers = [f'B{number}-USD' for number in range(min(size, 1000))]
+    types = ['%', '$', 'Above', 'Below']
+    alerts = []
+    for number in range(size):
+        alert_type = types[number % len(types)]
+        alerts.append(Alert(ticker=tickers[rng.integers(len(tickers))], type=alert_type,
+                            value=float(rng.uniform(0.1, 1) if alert_type in '%$' else rng.uniform(95, 105)),
+                            time_period=['1d', '5d'][number % 2], pre_post_data=bool(number % 3 == 0),
+                            id=number + 1, guild_id=GUILD_IDS[0], channel_id=CHANNEL_ID))
+    trades = [Trade(ticker=tickers[rng.integers(len(tickers))], shares=float(rng.integers(1, 100)),
+                    share_price=float(rng.uniform(50, 150)), sell=bool(number % 4 == 3), guild_id=GUILD_IDS[0])
+              for number in range(size)]
+
+    cog.alerts = AlertRegistry(alerts, GUILD_IDS[0])
+    cog.alerts_version += 1
+    cog.trades = trades
+    cog.portfolios = {GUILD_IDS[0]: Portfolio(trades)}
+    for journal, items in ((cog.alerts_journal, cog.alerts), (cog.trades_journal, cog.trades)):
+        seq, snapshot = journal.snapshot(items)
+        journal.write_snapshot(seq, snapshot)
+        journal.truncate(seq)
+        for file_name in journal.files:
+            if os.path.exists(file_name):
+                cog.storage.upload(file_name)
+    return tickers
+
+
+async def bench_size(size: int, repeat: int, yahoo: FakeYahoo) -> List[dict]:
+    bot = FakeBot()
+    cog = Stocks(bot)
+    await cog.ready.wait()
+    tickers = make_book(cog, size)
+    ctx = FakeContext(GUILD_IDS[0], CHANNEL_ID)
+    results = []
+
+    def poll_everything():
+        # Every quote due and nothing cached, so each repeat downloads the whole book
+        cog.scheduler = PollScheduler(cog.intervals)
+        price_cache.clear()
+
+    quotes = []
+
+    async def check_stocks():
+        quotes[:] = await cog.check_stocks()
+
+    results.append(await measure('check_stocks', size, check_stocks, repeat, setup=poll_everything))
+    results.append(await measure('process', size, lambda: cog.process(quotes), repeat))
+    await cog.notifier.wait()
+
+    alert = cog.alerts.get(1)
+    results.append(await measure('save', size, lambda: cog.save(cog.alerts_journal, cog.alerts,
+                                                                  ('set', 1, 'last_alert', alert.last_alert)),
+                                 repeat))
+    results.append(await measure('snapshot', size,
+                                 lambda: cog.alerts_journal.write_snapshot(
+                                     *cog.alerts_journal.snapshot(cog.alerts)),
+                                 repeat))
+    await cog.upload(cog.alerts_journal.files)
+    await cog.uploader.wait()
+    results.append(await measure('load', size, lambda: cog.load_journal(cog.alerts_journal, AlertRegistry,
+                                                                          AlertRegistry.apply), repeat))
+    results.append(await measure('load_trades', size, lambda: cog.load_journal(cog.trades_journal), repeat))
+
+    added = []
+
+    async def add():
+        await cog.add_price_alert.func(cog, ctx, tickers[0], 'Above', '101')
+        added.append(cog.alerts.next_id - 1)
+
+    results.append(await measure('add_alert', size, add, repeat))
+    results.append(await measure('list_alerts', size, lambda: cog.list_alerts.func(cog, ctx), repeat,
+                                 setup=add))
+    results.append(await measure('remove_alert', size, lambda: cog.remove_id_alert.func(cog, ctx, added.pop()),
+                                 repeat))
+    results.append(await measure('buy', size, lambda: cog.buy.func(cog, ctx, tickers[0], '1', '100'), repeat))
+    results.append(await measure('list_trades', size, lambda: cog.list_trades.func(cog, ctx), repeat,
+                                 setup=lambda: cog.buy.func(cog, ctx, tickers[0], '1', '100')))
+
+    await cog.flush()
+    cog.io.shutdown()
+    return results
+
+
+async def run(sizes: List[int], repeat: int, latency: float) -> List[dict]:
+    yahoo = FakeYahoo(latency)
+    yahoo.install()
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)  # the journals are written to the working directory
+            try:
+                results += await bench_size(size, repeat, yahoo)
+            finally:
+                os.chdir(cwd)
+    return results
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the Stocks cog against local fakes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds each fake yahoo download takes')
+    parser.add_argument('--fetch-rate', help='override FETCH_RATE, downloads per second the fetcher allows')
+    parser.add_argument('--output', default='benchmarks/results.json')
+    args = parser.parse_args(args)
+    if args.fetch_rate:
+        os.environ['FETCH_RATE'] = args.fetch_rate
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.get_event_loop().run_until_complete(run(args.sizes, args.repeat, args.latency))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Wrote {len(results)} results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
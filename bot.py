@@ -9,7 +9,17 @@ logger.setLevel(logging.DEBUG)
 logger.info('Test')
 TOKEN = os.environ['TOKEN']
 
-bot = commands.Bot(command_prefix='#')
+
+class Bot(commands.Bot):
+    async def close(self):
+        # Runs on SIGTERM too, send the state changes still waiting to be uploaded before the loop stops
+        stocks = self.get_cog('Stocks')
+        if stocks is not None:
+            await stocks.shutdown()
+        await super().close()
+
+
+bot = Bot(command_prefix='#')
 slash = SlashCommand(bot, sync_commands=True)
 
 bot.load_extension('cogs.Stocks')
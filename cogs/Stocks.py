@@ -1,37 +1,77 @@
-from typing import List, Any, Optional
-from discord.ext import commands, tasks
+from typing import Dict, Iterable, List, Optional
+import asyncio
+from collections import defaultdict
+import functools
+from discord.ext import commands
 import discord
-import yfinance as yf
-from dataclasses import dataclass
-from datetime import datetime
-import pickle
+import math
 import os
-import boto3
+import time
 import logging
-from discord_slash import SlashCommand, SlashContext, cog_ext
+from discord_slash import ButtonStyle, ComponentContext, SlashContext, cog_ext
 from discord_slash.utils.manage_commands import create_option, create_choice
+from discord_slash.utils.manage_components import create_actionrow, create_button
+from cogs.utils.executor import IOExecutor
+from cogs.utils.prices import PriceService
+from cogs.utils.engine import AlertEngine
+from cogs.utils.fetcher import Fetcher
+from cogs.utils.feeds import PollingSource, PriceSource, Quote, YahooStreamingSource, poll_seconds
+from cogs.utils.history import HistoryStore
+from cogs.utils.journal import Debouncer, Journal, apply as journal_apply
+from cogs.utils.markets import calendar
+from cogs.utils.metrics import metrics
+from cogs.utils.notify import Notifier
+from cogs.utils.pages import Listing
+from cogs.utils.portfolio import Portfolio, valuation
+from cogs.utils.profiler import SamplingProfiler
+from cogs.utils.records import Record
+from cogs.utils.registry import AlertRegistry
+from cogs.utils.scheduler import PollScheduler
+from cogs.utils.storage import Uploader, storage_from_env
 
 logger = logging.getLogger(__name__)
 
-GUILD_IDS = [821841802796859403]
+download_seconds = metrics.histogram('download_seconds', 'Seconds to download every due quote group in a poll')
+evaluate_seconds = metrics.histogram('evaluate_seconds', 'Seconds to apply a batch of quotes and evaluate alerts')
+save_seconds = metrics.histogram('save_seconds', 'Seconds to append ops to a journal')
+alerts_fired = metrics.counter('alerts_fired_total', 'Alerts that fired')
 
+GUILD_IDS = [int(guild_id) for guild_id in os.environ.get('GUILD_IDS', '821841802796859403').split(',')]
+# Where alerts made before they carried a channel are sent, they belong to the first guild in GUILD_IDS
+ALERT_CHANNEL = int(os.environ.get('ALERT_CHANNEL', 821841802796859406))
+ADMIN_IDS = [int(user_id) for user_id in os.environ.get('ADMIN_IDS', '').split(',') if user_id]
+# A deferred interaction can only be followed up for 15 minutes, so /Profile has to reply well before that
+MAX_PROFILE_SECONDS = 600
 
-@dataclass
-class Alert:
+
+class Alert(Record, transient=('dirty',)):
     ticker: str = ''
     type: str = ''
     value: float = 0
-    last_alert: datetime = None
+    last_alert: Optional[float] = None  # price the alert last fired at
     time_period: str = '1d'
     pre_post_data: bool = False
+    id: Optional[int] = None
+    guild_id: Optional[int] = None
+    channel_id: Optional[int] = None  # where the alert is sent
+    owner_id: Optional[int] = None  # who added it
+
+    # Set whenever last_alert changes and cleared once the change is journaled
+    dirty: bool = False
+
+    def __setattr__(self, name, value):
+        if name == 'last_alert' and value != getattr(self, 'last_alert', None):
+            super().__setattr__('dirty', True)
+        super().__setattr__(name, value)
 
 
-@dataclass
-class Trade:
+class Trade(Record):
     ticker: str = ''
     shares: float = 0
     share_price: float = 0  # price per share
     sell: bool = False
+    guild_id: Optional[int] = None  # trades made before they carried a guild belong to the first in GUILD_IDS
+    owner_id: Optional[int] = None  # who made it
 
     @property
     def buy(self):
@@ -42,13 +82,6 @@ class Trade:
         self.sell = not value
 
 
-@dataclass
-class Holding:
-    ticker: str = ''
-    amount: float = 0
-    cost_basis: float = 0
-
-
 class Options:
     ticker = create_option(
         name="ticker",
@@ -136,13 +169,34 @@ class Options:
         required=False,
     )
 
-    index = create_option(
-        name="index",
-        description="Alert Index",
+    alert_id = create_option(
+        name="alert_id",
+        description="Alert ID",
         option_type=4,
         required=True
     )
 
+    seconds = create_option(
+        name="seconds",
+        description=f"Longest time to profile for, at most {MAX_PROFILE_SECONDS}",
+        option_type=4,
+        required=False
+    )
+
+    ticks = create_option(
+        name="ticks",
+        description="Stop after this many polls",
+        option_type=4,
+        required=False
+    )
+
+    top = create_option(
+        name="top",
+        description="Number of hot functions to list",
+        option_type=4,
+        required=False
+    )
+
     shares = create_option(
         name="shares",
         description="Number of shares traded",
@@ -165,14 +219,27 @@ class Options:
     )
 
 
+def after_load(command):
+    """Hold a command that needs the alert and trade books until they're loaded, deferring the interaction so
+    discord waits for the reply"""
+    @functools.wraps(command)
+    async def wrapper(self, ctx, *args, **kwargs):
+        if not self.ready.is_set():
+            await ctx.defer()
+            await self.ready.wait()
+        return await command(self, ctx, *args, **kwargs)
+    return wrapper
+
+
 class Stocks(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
 
-        self.S3_BUCKET = os.environ['S3_BUCKET']
-        self.ACCESS_KEY_ID = os.environ['ACCESS_KEY_ID']
-        self.ACCESS_KEY = os.environ['ACCESS_KEY']
+        self.io = IOExecutor(max_workers=int(os.environ.get('IO_WORKERS', 8)))
+        self.storage = storage_from_env()
+        # Failed uploads go back through the debouncer, so they are retried after its delay
+        self.uploader = Uploader(self.storage, self.io, retry=lambda file_name: self.uploads.schedule(file_name))
 
         self.intervals = {
             '1d': '1m',
@@ -188,20 +255,111 @@ class Stocks(commands.Cog):
             'max': '1d',
         }
 
-        self.channels = {}
+        self.history = HistoryStore()
+        self.prices = PriceService(self.io)
+        self.fetcher = Fetcher(self.io,
+                               concurrency=int(os.environ.get('FETCH_CONCURRENCY', 4)),
+                               rate=float(os.environ.get('FETCH_RATE', 2)))
 
+        self.channels = {}
+        self.profiler: Optional[SamplingProfiler] = None
+        self.notifier = Notifier(self.send_embeds)
+
+
+        self.alerts_journal = Journal('Alerts.pkl')
+        self.trades_journal = Journal('Trades.pkl')
+        self.uploads = Debouncer(self.upload, delay=float(os.environ.get('SAVE_DELAY', 10)))
+        # Empty until startup() has loaded the stored books, commands that need them wait on ready
+        self.alerts = AlertRegistry(default_guild=GUILD_IDS[0])
+        self.trades: List[Trade] = []  # every guild's, in the order they are journaled
+        self.portfolios: Dict[int, Portfolio] = {}  # by guild
+        self.ready = asyncio.Event()
+        # (portfolio version, expiry, message) of the last /Portfolio reply per guild
+        self.valuations: Dict[int, tuple] = {}
+        self.valuation_ttl = float(os.environ.get('PORTFOLIO_TTL', 30))
+
+        self.listings: Dict[tuple, Listing] = {}  # by (name, guild), added as they're asked for
+
+        # Bumped on every journaled alert change, the engine's columnar copy of the book is rebuilt when it falls
+        # behind
+        self.alerts_version = 0
+        self.engine = AlertEngine()
+
+        # Polling always runs since it is the only source of period baselines for change alerts, a streaming
+        # source adds live ticks in between polls
+        self.scheduler = PollScheduler(self.intervals)
+        self.sources: List[PriceSource] = [PollingSource(self.check_stocks, seconds=15)]
+        if os.environ.get('PRICE_STREAM') == 'yahoo':
+            self.sources.append(YahooStreamingSource())
+        self.feeds: List[asyncio.Task] = []
+        self.closing: Optional[asyncio.Future] = None
+
+        # Runs as soon as the bot's loop starts, alongside logging in and connecting to the gateway
+        self.startup_task = self.bot.loop.create_task(self.startup())
+
+    async def startup(self):
+        """Download and replay the alert and trade books on the executor, then let waiting commands through"""
+        try:
+            alerts, trades = await asyncio.gather(
+                self.io.run(self.load_journal, self.alerts_journal,
+                            lambda alerts: AlertRegistry(alerts, GUILD_IDS[0]), AlertRegistry.apply),
+                self.io.run(self.load_journal, self.trades_journal))
+            self.portfolios = await self.io.run(self.build_portfolios, trades)
+            self.alerts = alerts
+            self.trades = trades
+            self.alerts_version += 1
+            logger.info(f'Loaded {len(alerts)} alerts and {len(trades)} trades')
+        except Exception as e:
+            # Same as a journal that can't be replayed, carry on with empty books rather than hold commands forever
+            logger.exception(f'Could not load state: {e}')
+        finally:
+            self.ready.set()
 
-        self.alerts_file = 'Alerts.pkl'
-        self.trades_file = 'Trades.pkl'
-        self.alerts: List[Alert] = self.load(self.alerts_file)
-        self.trades: List[Trade] = self.load(self.trades_file)
+    @staticmethod
+    def trade_guild(trade: Trade) -> int:
+        return GUILD_IDS[0] if trade.guild_id is None else trade.guild_id
+
+    @classmethod
+    def build_portfolios(cls, trades: Iterable[Trade]) -> Dict[int, Portfolio]:
+        by_guild = defaultdict(list)
+        for trade in trades:
+            by_guild[cls.trade_guild(trade)].append(trade)
+        return {guild_id: Portfolio(guild_trades) for guild_id, guild_trades in by_guild.items()}
+
+    def portfolio(self, guild_id: int) -> Portfolio:
+        portfolio = self.portfolios.get(guild_id)
+        if portfolio is None:
+            portfolio = self.portfolios[guild_id] = Portfolio()
+        return portfolio
+
+    def cog_unload(self):
+        asyncio.ensure_future(self.shutdown())
+
+    async def shutdown(self):
+        """Stop the feeds and send everything still pending. The bot awaits this from close(), so a restart
+        doesn't drop changes the upload debouncer is still holding."""
+        if self.closing is None:
+            self.startup_task.cancel()
+            for source, feed in zip(self.sources, self.feeds):
+                source.stop()
+                feed.cancel()
+            self.closing = asyncio.ensure_future(self.close_io())
+        await asyncio.shield(self.closing)
+
+    async def close_io(self):
+        await self.flush()
+        # Only once the uploads are done, they run on the pool
+        self.io.shutdown()
 
     @commands.Cog.listener()
     async def on_ready(self):
         logger.info(f'{self.bot.user} has connected to Discord!')
-        logger.info(f'Starting Stock Loop task')
-        self.check_stocks.start()
-        self.channels['general'] = self.bot.get_channel(821841802796859406)
+        if not self.feeds:
+            logger.info(f'Starting price feeds')
+            self.feeds = [asyncio.ensure_future(self.consume(source)) for source in self.sources]
+            if os.environ.get('METRICS_PORT'):
+                await metrics.serve(int(os.environ['METRICS_PORT']))
+        self.channels['general'] = self.bot.get_channel(ALERT_CHANNEL)
 
     @cog_ext.cog_subcommand(
         base='Add',
@@ -213,6 +371,7 @@ class Stocks(commands.Cog):
                  Options.trigger_price,
                  Options.prepost]
     )
+    @after_load
     async def add_price_alert(self, ctx: SlashContext,
                               ticker: str,
                               trigger_type: str,
@@ -220,10 +379,11 @@ class Stocks(commands.Cog):
                               pre_post_data: bool = False):
         value = await self.to_float(trigger_price, ctx)
         if value is not None:
-            self.alerts.append(Alert(ticker=ticker, type=trigger_type, value=value, pre_post_data=pre_post_data))
-            await ctx.send(f'Price alert added for {ticker} prices {trigger_type} ${value}')
-            logger.info(f'Price alert added for {ticker} prices {trigger_type} ${value}')
-        self.save(self.alerts, self.alerts_file)
+            alert = self.alerts.add(Alert(ticker=ticker, type=trigger_type, value=value, pre_post_data=pre_post_data,
+                                          **self.route(ctx)))
+            self.save(self.alerts_journal, self.alerts, ('add', alert))
+            await ctx.send(f'Price alert {alert.id} added for {ticker} prices {trigger_type} ${value}')
+            logger.info(f'Price alert {alert.id} added for {ticker} prices {trigger_type} ${value}')
 
     @cog_ext.cog_subcommand(
         base='Add',
@@ -236,6 +396,7 @@ class Stocks(commands.Cog):
                  Options.time_period,
                  Options.prepost]
     )
+    @after_load
     async def add_change_alert(self, ctx: SlashContext,
                                ticker: str,
                                change_type: str,
@@ -245,15 +406,16 @@ class Stocks(commands.Cog):
 
         value = await self.to_float(change_value, ctx)
         if value is not None:
-            self.alerts.append(Alert(ticker=ticker,
-                                     type=change_type,
-                                     value=value,
-                                     time_period=time_period,
-                                     pre_post_data=pre_post_data))
+            alert = self.alerts.add(Alert(ticker=ticker,
+                                          type=change_type,
+                                          value=value,
+                                          time_period=time_period,
+                                          pre_post_data=pre_post_data,
+                                          **self.route(ctx)))
+            self.save(self.alerts_journal, self.alerts, ('add', alert))
             val_text = f'${value}' if change_type == '$' else f'{value}%'
-            await ctx.send(f'Change alert added for {ticker} {val_text} over {time_period}')
-            logger.info(f'Change alert added for {ticker} {val_text} over {time_period}')
-        self.save(self.alerts, self.alerts_file)
+            await ctx.send(f'Change alert {alert.id} added for {ticker} {val_text} over {time_period}')
+            logger.info(f'Change alert {alert.id} added for {ticker} {val_text} over {time_period}')
 
     @cog_ext.cog_subcommand(
         base='Reset',
@@ -262,12 +424,14 @@ class Stocks(commands.Cog):
         guild_ids=GUILD_IDS,
         options=[]
     )
+    @after_load
     async def reset_all_alerts(self, ctx: SlashContext):
-        for alert in self.alerts:
+        alerts = self.alerts.guild(ctx.guild_id)
+        for alert in alerts:
             alert.last_alert = None
+        self.save_alerts(alerts)
         await ctx.send(f'All alerts reset')
         logger.info(f'All alerts reset')
-        self.save(self.alerts, self.alerts_file)
 
     @cog_ext.cog_subcommand(
         base='Reset',
@@ -276,30 +440,33 @@ class Stocks(commands.Cog):
         guild_ids=GUILD_IDS,
         options=[Options.ticker]
     )
+    @after_load
     async def reset_ticker_alerts(self, ctx: SlashContext, ticker: str):
-        for alert in self.alerts:
-            if alert.ticker == ticker:
-                alert.last_alert = None
+        alerts = [alert for alert in self.alerts.ticker(ticker) if self.alerts.guild_of(alert) == ctx.guild_id]
+        for alert in alerts:
+            alert.last_alert = None
+        self.save_alerts(alerts)
         await ctx.send(f'All {ticker} alerts reset')
         logger.info(f'All {ticker} alerts reset')
-        self.save(self.alerts, self.alerts_file)
 
     @cog_ext.cog_subcommand(
         base='Reset',
-        name='Alerts_By_Index',
-        description='Reset Alerts by index',
+        name='Alert_By_ID',
+        description='Reset Alert by ID',
         guild_ids=GUILD_IDS,
-        options=[Options.index]
+        options=[Options.alert_id]
     )
-    async def reset_index_alerts(self, ctx: SlashContext, index: int):
-        if 0 < index < len(self.alerts):
-            self.alerts[index].last_alert = None
-            await ctx.send(f'{self.alerts[index].ticker} alert reset')
-            logger.info(f'{self.alerts[index].ticker} alert reset')
+    @after_load
+    async def reset_id_alert(self, ctx: SlashContext, alert_id: int):
+        alert = self.guild_alert(ctx, alert_id)
+        if alert is not None:
+            alert.last_alert = None
+            self.save_alerts([alert])
+            await ctx.send(f'{alert.ticker} alert reset')
+            logger.info(f'{alert.ticker} alert reset')
         else:
-            await ctx.send(f'Index: {index} out of range')
-            logger.error(f'Index: {index} out of range')
-        self.save(self.alerts, self.alerts_file)
+            await ctx.send(f'No alert with ID {alert_id}')
+            logger.error(f'No alert with ID {alert_id}')
 
     @cog_ext.cog_subcommand(
         base='Remove',
@@ -308,11 +475,12 @@ class Stocks(commands.Cog):
         guild_ids=GUILD_IDS,
         options=[]
     )
+    @after_load
     async def remove_all_alerts(self, ctx: SlashContext):
-        self.alerts = []
+        self.alerts.clear(ctx.guild_id)
+        self.save(self.alerts_journal, self.alerts, ('clear', ctx.guild_id))
         await ctx.send(f'All alerts removed')
         logger.info(f'All alerts removed')
-        self.save(self.alerts, self.alerts_file)
 
     @cog_ext.cog_subcommand(
         base='Remove',
@@ -321,35 +489,34 @@ class Stocks(commands.Cog):
         guild_ids=GUILD_IDS,
         options=[Options.ticker]
     )
+    @after_load
     async def remove_ticker_alerts(self, ctx: SlashContext, ticker: str):
-        old_len = len(self.alerts)
-        self.alerts = [alert for alert in self.alerts if alert.ticker != ticker]
-
-        if old_len != len(self.alerts):
+        if self.alerts.remove_ticker(ticker, ctx.guild_id):
+            self.save(self.alerts_journal, self.alerts, ('remove_ticker', ticker, ctx.guild_id))
             await ctx.send(f'All {ticker} alerts removed')
             logger.info(f'All {ticker} alerts removed')
         else:
             await ctx.send(f'No alerts for {ticker} found')
             logger.warning(f'No alerts for {ticker} found')
-        self.save(self.alerts, self.alerts_file)
 
     @cog_ext.cog_subcommand(
         base='Remove',
-        name='Alerts_By_Index',
-        description='Remove Alerts by index',
+        name='Alert_By_ID',
+        description='Remove Alert by ID',
         guild_ids=GUILD_IDS,
-        options=[Options.index]
+        options=[Options.alert_id]
     )
-    async def remove_index_alerts(self, ctx: SlashContext, index: int):
-        if 0 < index < len(self.alerts):
-            alert = self.alerts[index]
-            self.alerts.pop(index)
+    @after_load
+    async def remove_id_alert(self, ctx: SlashContext, alert_id: int):
+        alert = self.guild_alert(ctx, alert_id)
+        if alert is not None:
+            self.alerts.remove(alert_id)
+            self.save(self.alerts_journal, self.alerts, ('remove', alert_id))
             await ctx.send(f'Removed {alert.ticker} alert')
             logger.info(f'Removed {alert.ticker} alert')
         else:
-            await ctx.send(f'Index: {index} out of range')
-            logger.error(f'Index: {index} out of range')
-        self.save(self.alerts, self.alerts_file)
+            await ctx.send(f'No alert with ID {alert_id}')
+            logger.error(f'No alert with ID {alert_id}')
 
     @cog_ext.cog_subcommand(
         base='List',
@@ -358,12 +525,17 @@ class Stocks(commands.Cog):
         guild_ids=GUILD_IDS,
         options=[]
     )
+    @after_load
     async def list_alerts(self, ctx: SlashContext):
-        msg = ''
-        for index, alert in enumerate(self.alerts):
-            msg += f'{index}: {alert.ticker} - {alert.value}{alert.type}\n'
-        msg = 'No active alerts' if msg == '' else msg
-        await ctx.send(msg)
+        await ctx.send(**self.list_page('alerts', ctx.guild_id, 0))
+
+    def route(self, ctx: SlashContext) -> dict:
+        """Routing fields of an alert added by ctx, it is sent to the channel it was added in"""
+        return {'guild_id': ctx.guild_id, 'channel_id': ctx.channel_id, 'owner_id': ctx.author_id}
+
+    def guild_alert(self, ctx: SlashContext, alert_id: int) -> Optional[Alert]:
+        alert = self.alerts.get(alert_id)
+        return alert if alert is not None and self.alerts.guild_of(alert) == ctx.guild_id else None
 
     @cog_ext.cog_subcommand(
         base='Check',
@@ -374,16 +546,12 @@ class Stocks(commands.Cog):
     )
     async def check_paring(self, ctx: SlashContext, ticker: str, ticker2: str):
         try:
-            data = yf.download(f'{ticker} {ticker2}',
-                               period='1d',
-                               interval='1m',
-                               group_by='ticker',
-                               prepost=True)
+            frames = await self.prices.history([ticker, ticker2], period='1d', interval='1m', prepost=True)
+            p1 = frames[ticker.upper()]['Close'].iloc[0]
+            p2 = frames[ticker2.upper()]['Close'].iloc[0]
         except:
             logger.error('Could not download data')
             return
-        p1 = data[ticker]['Close'][0]
-        p2 = data[ticker2]['Close'][0]
         price = f'{(p2/p1):.15f}'
         msg = f'Current estimated price is {price.rstrip("0").rstrip(".")} {ticker}/{ticker2}'
         await ctx.send(msg)
@@ -398,6 +566,7 @@ class Stocks(commands.Cog):
                  Options.share_price,
                  Options.total_price]
     )
+    @after_load
     async def buy(self, ctx: SlashContext, ticker: str, shares: str,
                    share_price: str = None, total_price: str = None):
 
@@ -413,15 +582,20 @@ class Stocks(commands.Cog):
             elif share_price is None and total_price is None:
                 await ctx.send(f'Error: Must have share_price or total_price')
                 logger.error(f'Error: Must have share_price or total_price')
+                return
             else:
                 await ctx.send(f'Error: Can\'t have both share_price and total_price')
                 logger.error(f'Error: Can\'t have both share_price and total_price')
+                return
         else:
             return
-        self.trades.append(Trade(ticker=ticker, share_price=share_price, shares=shares, sell=False))
+        trade = Trade(ticker=ticker, share_price=share_price, shares=shares, sell=False,
+                      guild_id=ctx.guild_id, owner_id=ctx.author_id)
+        self.trades.append(trade)
+        self.portfolio(ctx.guild_id).apply(trade)
+        self.save(self.trades_journal, self.trades, ('append', trade))
         await ctx.send(f'Bought {shares} shares of  {ticker} at ${share_price} per share')
         logger.info(f'Bought {shares} shares of  {ticker} at ${share_price} per share')
-        self.save(self.trades, self.trades_file)
 
     @cog_ext.cog_slash(
         name='Sell',
@@ -432,6 +606,7 @@ class Stocks(commands.Cog):
                  Options.share_price,
                  Options.total_price]
     )
+    @after_load
     async def sell(self, ctx: SlashContext, ticker: str, shares: str,
                    share_price: str = None, total_price: str = None):
 
@@ -447,15 +622,108 @@ class Stocks(commands.Cog):
             elif share_price is None and total_price is None:
                 await ctx.send(f'Error: Must have share_price or total_price')
                 logger.error(f'Error: Must have share_price or total_price')
+                return
             else:
                 await ctx.send(f'Error: Can\'t have both share_price and total_price')
                 logger.error(f'Error: Can\'t have both share_price and total_price')
+                return
         else:
             return
-        self.trades.append(Trade(ticker=ticker, share_price=share_price, shares=shares, sell=True))
+        trade = Trade(ticker=ticker, share_price=share_price, shares=shares, sell=True,
+                      guild_id=ctx.guild_id, owner_id=ctx.author_id)
+        self.trades.append(trade)
+        self.portfolio(ctx.guild_id).apply(trade)
+        self.save(self.trades_journal, self.trades, ('append', trade))
         await ctx.send(f'Sold {shares} shares of  {ticker} at ${share_price} per share')
         logger.info(f'Sold {shares} shares of  {ticker} at ${share_price} per share')
-        self.save(self.trades, self.trades_file)
+
+    @cog_ext.cog_slash(
+        name='Stats',
+        description='Show alert loop timings and counters',
+        guild_ids=GUILD_IDS,
+        options=[]
+    )
+    async def stats(self, ctx: SlashContext):
+        await ctx.send(f'```\n{metrics.summary()}\n```')
+
+    @cog_ext.cog_slash(
+        name='Profile',
+        description='Sample the bot for a while and list the hot functions (admins only)',
+        guild_ids=GUILD_IDS,
+        options=[Options.seconds, Options.ticks, Options.top]
+    )
+    async def profile(self, ctx: SlashContext, seconds: int = 30, ticks: Optional[int] = None, top: int = 10):
+        permissions = getattr(ctx.author, 'guild_permissions', None)
+        if ctx.author_id not in ADMIN_IDS and not (permissions is not None and permissions.administrator):
+            await ctx.send('Error: Only admins can profile the bot')
+            return
+        if self.profiler is not None and self.profiler.running:
+            await ctx.send('Error: Already profiling')
+            return
+        await ctx.defer()
+
+        # Samples the event loop's thread, which runs check_stocks and every command handler
+        self.profiler = profiler = SamplingProfiler()
+        polls = poll_seconds.count
+        deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+        profiler.start()
+        try:
+            while time.monotonic() < deadline and (ticks is None or poll_seconds.count - polls < ticks):
+                await asyncio.sleep(0.5)
+        finally:
+            profiler.stop()
+
+        directory = os.environ.get('PROFILE_DIR', 'profiles')
+        file_name = os.path.join(directory, f'profile-{int(profiler.started)}.collapsed')
+        await self.io.run(os.makedirs, directory, exist_ok=True)
+        await self.io.run(profiler.write, file_name)
+        logger.info(f'Wrote {profiler.samples} samples to {file_name}')
+        await ctx.send(f'```\n{profiler.summary(top)[:1900]}\n```Collapsed stacks saved to {file_name}')
+
+    @cog_ext.cog_slash(
+        name='Portfolio',
+        description='Value open holdings at current prices',
+        guild_ids=GUILD_IDS,
+        options=[]
+    )
+    @after_load
+    async def portfolio_value(self, ctx: SlashContext):
+        portfolio = self.portfolio(ctx.guild_id)
+        version, expiry, msg = self.valuations.get(ctx.guild_id, (None, 0, ''))
+        if version != portfolio.version or time.time() >= expiry:
+            msg = await self.value_portfolio(portfolio)
+            self.valuations[ctx.guild_id] = (portfolio.version, time.time() + self.valuation_ttl, msg)
+        await ctx.send(msg)
+
+    async def value_portfolio(self, portfolio: Portfolio) -> str:
+        holdings = portfolio.open()
+        if not holdings:
+            return 'No open holdings'
+        try:
+            frames = await self.prices.history([holding.ticker for holding in holdings],
+                                               period='1d', interval='1m', prepost=True)
+        except Exception as e:
+            logger.error(f'Could not download data for portfolio: {e}')
+            frames = {}
+        quotes = {}
+        for ticker, frame in frames.items():
+            close = frame['Close'].dropna()
+            if len(close):
+                quotes[ticker] = close.iloc[-1]
+
+        table = valuation(holdings, quotes)
+        msg = ''
+        for ticker, row in table.iterrows():
+            if math.isnan(row.price):
+                msg += f'{ticker}: {row.amount:g} shares, cost ${row.cost_basis:,.2f}, no price\n'
+            else:
+                change = 'n/a' if math.isnan(row.change) else f'{row.change:+.2%}'
+                msg += (f'{ticker}: {row.amount:g} shares at ${row.price:,.2f} = ${row.value:,.2f}, '
+                        f'P&L ${row.unrealized:+,.2f} ({change})\n')
+        priced = table.dropna(subset=['price'])
+        msg += (f'Total: ${priced.value.sum():,.2f}, unrealized P&L ${priced.unrealized.sum():+,.2f}, '
+                f'realized P&L ${sum(holding.realized for holding in portfolio):+,.2f}')
+        return msg
 
     @cog_ext.cog_subcommand(
         base='List',
@@ -464,75 +732,159 @@ class Stocks(commands.Cog):
         guild_ids=GUILD_IDS,
         options=[]
     )
-    async def list_alerts(self, ctx: SlashContext):
-        msg = ''
-        for index, trade in enumerate(self.trades):
-            msg += f'{index}: {trade.ticker}: {trade.shares} shares at {trade.share_price}\n'
-        msg = 'No active alerts' if msg == '' else msg
-        await ctx.send(msg)
+    @after_load
+    async def list_trades(self, ctx: SlashContext):
+        await ctx.send(**self.list_page('trades', ctx.guild_id, 0))
+
+    def listing(self, name: str, guild_id: Optional[int]) -> Optional[Listing]:
+        key = (name, guild_id)
+        if key not in self.listings and name == 'alerts':
+            self.listings[key] = Listing(lambda: self.alerts.guild(guild_id), lambda: self.alerts.version,
+                                         lambda _, alert: f'{alert.id}: {alert.ticker} - {alert.value}{alert.type}',
+                                         empty='No active alerts')
+        elif key not in self.listings and name == 'trades':
+            self.listings[key] = Listing(lambda: self.portfolio(guild_id).trades,
+                                         lambda: self.portfolio(guild_id).version,
+                                         lambda index, trade: f'{index}: {trade.ticker}: {trade.shares} shares at '
+                                                              f'{trade.share_price}',
+                                         empty='No trades')
+        return self.listings.get(key)
+
+    def list_page(self, name: str, guild_id: Optional[int], number: int) -> dict:
+        """Message fields for a page of a listing, with previous/next buttons when there's more than one page"""
+        listing = self.listing(name, guild_id)
+        text, number = listing.page(number)
+        count = listing.count
+        if count == 1:
+            return {'content': text, 'components': []}
+        buttons = create_actionrow(
+            create_button(style=ButtonStyle.gray, label='Previous', custom_id=f'list:{name}:{number - 1}',
+                          disabled=number == 0),
+            create_button(style=ButtonStyle.gray, label='Next', custom_id=f'list:{name}:{number + 1}',
+                          disabled=number == count - 1),
+        )
+        return {'content': text, 'components': [buttons]}
 
-    @tasks.loop(minutes=1)
-    async def check_stocks(self):
-        logger.info(f'Checking Stocks')
-        channel = self.bot.get_channel(821841802796859406)
-        for alert in self.alerts:
+    @commands.Cog.listener()
+    async def on_component(self, ctx: ComponentContext):
+        prefix, _, page = ctx.custom_id.partition(':')
+        name, _, number = page.partition(':')
+        if prefix != 'list' or self.listing(name, ctx.guild_id) is None:
+            return
+        await ctx.edit_origin(**self.list_page(name, ctx.guild_id, int(number)))
+
+    async def check_stocks(self) -> List[Quote]:
+        """Poll yahoo for the (ticker, period, prepost) quotes the scheduler says are due"""
+        self.refresh_engine()
+        now = time.time()
+        self.scheduler.sync(self.engine.columns.keys, now)
+        self.history.retain((ticker, self.intervals[period], prepost)
+                            for ticker, period, prepost in self.engine.columns.keys)
+        due = self.scheduler.pop_due(now)
+        if not due:
+            return []
+
+        # Closed markets aren't downloaded at all, their quotes only mark the alerts on them as out of session
+        quotes = []
+        groups = defaultdict(list)
+        for ticker, period, prepost in due:
+            if calendar.is_open(ticker, prepost):
+                groups[(period, self.intervals[period], prepost)].append(ticker)
+            else:
+                quotes.append(Quote(ticker=ticker, price=math.nan, time=now, period=period, prepost=prepost,
+                                    fresh=False))
+        logger.info(f'Checking {len(due) - len(quotes)} Stocks')
+
+        with download_seconds.time():
+            results = await asyncio.gather(*(self.fetch_group(tickers, period, interval, prepost)
+                                             for (period, interval, prepost), tickers in groups.items()))
+        for ((period, interval, prepost), tickers), frames in zip(groups.items(), results):
+            for ticker in tickers:
+                close = frames[ticker]['Close'].dropna() if ticker in frames else []
+                if len(close) == 0:
+                    logger.warning(f'No data for {ticker}')
+                    continue
+                quotes.append(Quote(ticker=ticker,
+                                    price=float(close.iloc[-1]),
+                                    time=close.index[-1].timestamp(),
+                                    period=period,
+                                    prepost=prepost,
+                                    baseline=float(close.iloc[0]),
+                                    fresh=calendar.bar_date(ticker, close.index[-1]) == calendar.today(ticker)))
+
+        polled = {(quote.ticker, quote.period, quote.prepost): quote.price for quote in quotes if quote.fresh}
+        for key in due:
+            self.scheduler.observe(key, polled.get(key), now)
+        return quotes
+
+    async def fetch_group(self, tickers: List[str], period: str, interval: str, prepost: bool):
+        fetch = self.history.window if interval in self.history.intervals else self.prices.history
+        try:
+            return await self.fetcher.fetch(fetch, tickers, period=period, interval=interval, prepost=prepost)
+        except Exception as e:
+            logger.error(f'Could not download data for {period} {interval}: {e}')
+            return {}
+
+    def refresh_engine(self):
+        """Rebuild the engine's columns if the alert book changed since they were built"""
+        if self.engine.version != self.alerts_version:
+            self.engine.load(self.alerts, self.alerts_version)
+            for source in self.sources:
+                source.subscribe(self.engine.tickers)
+
+    async def process(self, quotes: List[Quote]):
+        """Evaluate the alerts affected by a batch of quotes from any price source and queue what fired"""
+        self.refresh_engine()
+        with evaluate_seconds.time():
+            result = self.engine.evaluate(self.engine.update(quotes))
+        alerts_fired.inc(len(result.fired))
+        alerts = self.engine.columns.alerts
+
+        changed = []
+        for index in result.reset:
+            alerts[index].last_alert = None
+            changed.append(alerts[index])
+        for index, alert_price in zip(result.fired, result.price):
+            alerts[index].last_alert = float(alert_price)
+            changed.append(alerts[index])
+        # Nothing else runs between the evaluation and the save, so the columns still match the book afterwards
+        self.save_alerts(changed)
+        self.engine.columns.version = self.alerts_version
+
+        for index, alert_price, change in zip(result.fired, result.price, result.change):
+            alert = alerts[index]
+            self.notifier.post(alert.channel_id or ALERT_CHANNEL,
+                               self.alert_embed(alert, alert_price, change).to_dict())
+
+    async def send_embeds(self, channel_id: int, embeds: List[dict]):
+        route = discord.http.Route('POST', '/channels/{channel_id}/messages', channel_id=channel_id)
+        await self.bot.http.request(route, json={'embeds': embeds})
+
+    async def consume(self, source: PriceSource):
+        await self.ready.wait()
+        async for quotes in source.quotes():
             try:
-                data = yf.download(alert.ticker,
-                                   period=alert.time_period,
-                                   interval=self.intervals[alert.time_period],
-                                   prepost=alert.pre_post_data)
-            except:
-                logger.error('Could not download data')
-                continue
-
-            close = data['Close']
-            if close.index[-1].date() != datetime.now().date():
-                alert.last_alert = None
-                continue
-
-            prev_value = alert.last_alert if alert.last_alert is not None else close[0]
-            if alert.type == '%':
-                change = round(100 * (close[-1] - prev_value) / prev_value, 2)
-                if abs(change) > alert.value:
-                    em = discord.Embed()
-                    em.colour = 0x00ff00 if change > alert.value else 0xff0000
-                    em.description = f'[{alert.ticker}](https://finance.yahoo.com/quote/{alert.ticker}) changed by ' \
-                                     f'{change}%  Price: ${round(close[-1], 2)}'
-                    await channel.send(embed=em)
-                    alert.last_alert = close[-1]
-            elif alert.type == '$':
-                change = round(close[-1] - prev_value, 2)
-                if abs(change) > alert.value:
-                    em = discord.Embed()
-                    em.colour = 0x00ff00 if change > alert.value else 0xff0000
-                    em.description = f'[{alert.ticker}](https://finance.yahoo.com/quote/{alert.ticker}) changed by ' \
-                                     f'${change} Price: ${round(close[-1], 2)}'
-                    await channel.send(embed=em)
-                    alert.last_alert = close[-1]
-
-            elif alert.type == 'Above':
-                if close[-1] > alert.value and alert.last_alert is None:
-                    em = discord.Embed()
-                    em.colour = 0x00ff00 if close[-1] > alert.value else 0xff0000
-                    em.description = f'[{alert.ticker}](https://finance.yahoo.com/quote/{alert.ticker}) is above ' \
-                                     f'${alert.value} Price: ${round(close[-1], 2)}'
-                    await channel.send(embed=em)
-                    alert.last_alert = close[-1]
-                elif close[-1] < alert.value:
-                    alert.last_alert = None
-
-            elif alert.type == 'Below':
-                if close[-1] < alert.value and alert.last_alert is None:
-                    em = discord.Embed()
-                    em.colour = 0x00ff00 if close[-1] > alert.value else 0xff0000
-                    em.description = f'[{alert.ticker}](https://finance.yahoo.com/quote/{alert.ticker}) is below ' \
-                                     f'${alert.value} Price: ${round(close[-1], 2)}'
-                    await channel.send(embed=em)
-                    alert.last_alert = close[-1]
-                elif close[-1] > alert.value:
-                    alert.last_alert = None
-
-        self.save(self.alerts, self.alerts_file)
+                await self.process(quotes)
+            except Exception as e:
+                logger.exception(f'Could not process {len(quotes)} quotes: {e}')
+
+    @staticmethod
+    def alert_embed(alert: Alert, price: float, change: float) -> discord.Embed:
+        em = discord.Embed()
+        link = f'[{alert.ticker}](https://finance.yahoo.com/quote/{alert.ticker})'
+        if alert.type == '%':
+            em.colour = 0x00ff00 if change > alert.value else 0xff0000
+            em.description = f'{link} changed by {change}%  Price: ${round(price, 2)}'
+        elif alert.type == '$':
+            em.colour = 0x00ff00 if change > alert.value else 0xff0000
+            em.description = f'{link} changed by ${change} Price: ${round(price, 2)}'
+        elif alert.type == 'Above':
+            em.colour = 0x00ff00 if price > alert.value else 0xff0000
+            em.description = f'{link} is above ${alert.value} Price: ${round(price, 2)}'
+        elif alert.type == 'Below':
+            em.colour = 0x00ff00 if price > alert.value else 0xff0000
+            em.description = f'{link} is below ${alert.value} Price: ${round(price, 2)}'
+        return em
 
     @staticmethod
     async def to_float(s: Optional[str], ctx: SlashContext) -> Optional[float]:
@@ -545,27 +897,72 @@ class Stocks(commands.Cog):
             logger.error(f'Error: Could not convert "{s}" to number')
             return None
 
-    def save(self, obj, file_name):
+    def save(self, journal: Journal, items: List, *ops):
+        """Journal ops that were just applied to items and schedule the files for upload"""
+        with save_seconds.time():
+            journal.append(*ops)
+        if journal is self.alerts_journal:
+            self.alerts_version += 1
+        if journal.needs_compaction:
+            journal.compacting = True
+            asyncio.ensure_future(self.compact(journal, *journal.snapshot(items)))
+        self.uploads.schedule(*journal.files)
+
+    def save_alerts(self, alerts: Optional[Iterable[Alert]] = None):
+        """Journal the last_alert of every alert (default all) that changed since it was last saved, if any did"""
+        changes = []
+        for alert in self.alerts if alerts is None else alerts:
+            # Alerts removed while a tick was running are no longer in the registry and have nothing to save
+            if alert.dirty and alert.id in self.alerts:
+                changes.append(('set', alert.id, 'last_alert', alert.last_alert))
+                alert.dirty = False
+        if changes:
+            self.save(self.alerts_journal, self.alerts, *changes)
+
+    async def compact(self, journal: Journal, seq: int, items: List):
+        """Write and upload a snapshot, and only then cut the log it covers.
+
+        Storage must never hold a truncated log next to an older snapshot, replaying that would skip everything
+        in between. If the snapshot doesn't land the log is kept whole and the snapshot upload is retried.
+        """
         try:
-            logger.info(f'Saving {file_name} to s3')
-            with open(file_name, 'wb') as f:
-                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
-            s3 = boto3.client('s3', aws_access_key_id=self.ACCESS_KEY_ID, aws_secret_access_key=self.ACCESS_KEY)
-            s3.upload_file(file_name, self.S3_BUCKET, file_name)
+            if await self.io.run(journal.write_snapshot, seq, items):
+                if await self.uploader.sync(journal.snapshot_file):
+                    journal.truncate(seq)
+                else:
+                    logger.warning(f'Kept {journal.journal_file} whole, {journal.snapshot_file} was not saved')
         except:
-            logger.error('Could not save file to s3')
-
-    def load(self, file_name) -> Any:
+            logger.error(f'Could not compact {journal.journal_file}')
+        finally:
+            journal.compacting = False
+        self.uploads.schedule(journal.journal_file)
+
+    async def flush(self):
+        """Send pending uploads and notifications now and wait for everything in flight"""
+        await self.uploads.drain()
+        await asyncio.gather(self.uploader.wait(), self.notifier.wait())
+
+    def load_journal(self, journal: Journal, build=list, apply=journal_apply):
+        for file_name in journal.files:
+            self.download(file_name)
         try:
-            logger.info(f'Loading {file_name} from s3')
-            s3 = boto3.client('s3', aws_access_key_id=self.ACCESS_KEY_ID, aws_secret_access_key=self.ACCESS_KEY)
-            s3.download_file(self.S3_BUCKET, file_name, file_name)
-            with open(file_name, 'rb') as f:
-                return pickle.load(f)
+            return journal.replay(build, apply)
         except:
-            logger.error('Could not load file from s3')
-            return []
+            logger.error(f'Could not replay {journal.journal_file}')
+            return build([])
+
+    async def upload(self, file_names: List[str]):
+        for file_name in file_names:
+            logger.info(f'Saving {file_name}')
+            self.uploader.upload(file_name)
 
+    def download(self, file_name):
+        try:
+            logger.info(f'Loading {file_name}')
+            if not self.storage.download(file_name):
+                logger.warning(f'No stored copy of {file_name}')
+        except:
+            logger.error(f'Could not load {file_name}')
 
 def setup(bot):
     bot.add_cog(Stocks(bot))
@@ -0,0 +1,209 @@
+"""Offline replay of bar data through the alert engine.
+
+    python -m cogs.utils.backtest --alerts 10000 --tickers 100 --days 5
+    python -m cogs.utils.backtest --bars bars.csv --alerts Alerts.pkl
+
+Bars are a csv with ticker, time and close columns (time as epoch seconds or anything pandas parses). Without
+--bars a random walk is generated. --alerts is either a number of random alerts or an alert journal snapshot,
+which needs the bot's own dependencies to unpickle.
+"""
+import argparse
+import asyncio
+import time
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from cogs.utils.engine import AlertEngine, TYPE_CODES
+from cogs.utils.feeds import PriceSource, Quote, ReplaySource
+from cogs.utils.history import period_start
+from cogs.utils.records import Record
+
+
+class BacktestAlert(Record):
+    """Stand in for the cog's Alert with just the fields the engine reads"""
+    ticker: str = ''
+    type: str = ''
+    value: float = 0
+    last_alert: Optional[float] = None
+    time_period: str = '1d'
+    pre_post_data: bool = False
+    id: Optional[int] = None
+
+
+class Fired(NamedTuple):
+    time: float  # time of the quote that fired the alert
+    alert: object
+    price: float
+    change: float
+
+
+class Report(NamedTuple):
+    quotes: int
+    batches: int
+    fired: int
+    seconds: float
+    latencies: np.ndarray  # seconds from a batch arriving to its fired alerts reaching the sink
+    skipped: int = 0  # alerts no replayed quote matched, so they were never evaluated
+
+    @property
+    def alerts_per_second(self) -> float:
+        return self.fired / self.seconds if self.seconds else 0.0
+
+    @property
+    def quotes_per_second(self) -> float:
+        return self.quotes / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        p50, p99, worst = (np.percentile(self.latencies, [50, 99, 100]) * 1000 if len(self.latencies)
+                           else (0.0, 0.0, 0.0))
+        return (f'{self.quotes} quotes in {self.batches} batches, '
+                f'{self.fired} alerts fired in {self.seconds:.3f}s\n'
+                f'{self.quotes_per_second:,.0f} quotes/s, {self.alerts_per_second:,.0f} alerts/s\n'
+                f'latency p50 {p50:.3f}ms, p99 {p99:.3f}ms, max {worst:.3f}ms'
+                + (f'\n{self.skipped} alerts had no quotes to evaluate against' if self.skipped else ''))
+
+
+class Backtest:
+    """Runs a price source through the same update/evaluate path as the cog and collects what fires"""
+
+    def __init__(self, alerts: Sequence):
+        self.engine = AlertEngine()
+        self.engine.load(alerts, 0)
+        self.sink: List[Fired] = []
+        self.quoted = np.zeros(len(self.engine.columns.keys), dtype=bool)  # quote keys the replay reached
+
+    @property
+    def skipped(self) -> List:
+        """Alerts whose (ticker, period, prepost) quote never came up in the replay"""
+        columns = self.engine.columns
+        return [columns.alerts[index] for index in np.flatnonzero(~self.quoted[columns.quote]).tolist()]
+
+    def process(self, quotes: List[Quote]):
+        touched = self.engine.update(quotes)
+        self.quoted |= touched
+        result = self.engine.evaluate(touched)
+        alerts = self.engine.columns.alerts
+        at = quotes[-1].time
+        self.sink.extend(Fired(at, alerts[index], price, change) for index, price, change
+                         in zip(result.fired.tolist(), result.price.tolist(), result.change.tolist()))
+
+    async def run(self, source: PriceSource) -> Report:
+        latencies = []
+        count = batches = fired = 0
+        start = time.perf_counter()
+        async for quotes in source.quotes():
+            received = time.perf_counter()
+            before = len(self.sink)
+            self.process(quotes)
+            latencies.append(time.perf_counter() - received)
+            count += len(quotes)
+            batches += 1
+            fired += len(self.sink) - before
+        return Report(count, batches, fired, time.perf_counter() - start, np.array(latencies), len(self.skipped))
+
+
+def bar_quotes(bars: pd.DataFrame, periods: Iterable[str] = ('1d',),
+               prepost: Iterable[bool] = (False,)) -> Iterator[Quote]:
+    """Quotes for every bar, period and prepost flag, in time order, with the first close of the period as the
+    baseline. Bars carry no session, so alerts with and without pre/post market data see the same bars.
+
+    Every new day starts with an out of session quote for each ticker seen so far, which resets alerts the same
+    way the market closing does in the live loop.
+    """
+    bars = bars.sort_values(['time', 'ticker'], kind='stable')
+    times = pd.to_datetime(bars['time'], unit='s' if np.issubdtype(bars['time'].dtype, np.number) else None)
+    bars = bars.assign(time=times.values.astype('datetime64[ns]').astype(np.int64) / 1e9,
+                       day=times.dt.normalize().values, stamp=times.values)
+    columns = {}
+    for period in periods:
+        baseline = np.empty(len(bars))
+        for _, group in bars.groupby('ticker', sort=False):
+            stamps = pd.DatetimeIndex(group['stamp'])
+            days = stamps.normalize()
+            if period == '1d':
+                starts = days
+            else:
+                first_day = {day: period_start(period, day) or stamps[0] for day in days.unique()}
+                starts = pd.DatetimeIndex(days.map(first_day))
+            first = np.searchsorted(stamps.values, starts.values)
+            baseline[bars.index.get_indexer(group.index)] = group['close'].values[first]
+        columns[period] = baseline
+
+    sessions = list(prepost)
+    seen = {}  # dict used as an ordered set of tickers
+    day = None
+    for position, (ticker, at, close, today) in enumerate(zip(bars['ticker'].tolist(), bars['time'].tolist(),
+                                                              bars['close'].tolist(), bars['day'].tolist())):
+        if today != day:
+            # Own timestamp so the resets form their own batch instead of being overwritten by the day's bars
+            midnight = pd.Timestamp(today).timestamp()
+            for stale in seen:
+                for period in columns:
+                    for session in sessions:
+                        yield Quote(stale, np.nan, midnight, period, prepost=session, fresh=False)
+            day = today
+        seen[ticker] = None
+        for period, baseline in columns.items():
+            for session in sessions:
+                yield Quote(ticker, close, at, period, prepost=session, baseline=baseline[position])
+
+
+def synthetic_bars(tickers: int = 100, days: int = 5, bars_per_day: int = 390, seed: int = 0) -> pd.DataFrame:
+    """One minute random walk bars over regular sessions"""
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range('2021-01-04', periods=days) + pd.Timedelta(hours=14, minutes=30)
+    stamps = (sessions.values[:, None] + np.arange(bars_per_day) * np.timedelta64(1, 'm')).ravel()
+    names = [f'T{number}' for number in range(tickers)]
+    walk = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, (len(stamps), tickers)), axis=0))
+    return pd.DataFrame({
+        'ticker': np.tile(names, len(stamps)),
+        'time': np.repeat(stamps.astype('datetime64[s]').astype(np.int64), tickers),
+        'close': walk.ravel(),
+    })
+
+
+def synthetic_alerts(count: int, tickers: Sequence[str], seed: int = 0) -> List[BacktestAlert]:
+    rng = np.random.default_rng(seed)
+    types = list(TYPE_CODES)
+    alerts = []
+    for number in range(count):
+        alert_type = types[rng.integers(len(types))]
+        value = {'%': rng.uniform(0.5, 3), '$': rng.uniform(0.5, 3)}.get(alert_type, rng.uniform(95, 105))
+        alerts.append(BacktestAlert(ticker=tickers[rng.integers(len(tickers))], type=alert_type,
+                                    value=round(value, 2), pre_post_data=bool(number % 3 == 0), id=number + 1))
+    return alerts
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Replay bars through the alert engine')
+    parser.add_argument('--bars', help='csv of ticker, time, close bars (default: random walk)')
+    parser.add_argument('--alerts', default='1000', help='number of random alerts or an alert journal snapshot')
+    parser.add_argument('--tickers', type=int, default=100, help='tickers in the random walk')
+    parser.add_argument('--days', type=int, default=5, help='sessions in the random walk')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    bars = pd.read_csv(args.bars) if args.bars else synthetic_bars(args.tickers, args.days, seed=args.seed)
+    if args.alerts.isdigit():
+        alerts = synthetic_alerts(int(args.alerts), bars['ticker'].unique().tolist(), args.seed)
+    else:
+        from cogs.utils.journal import Journal
+        from cogs.utils.registry import AlertRegistry
+        alerts = list(Journal(args.alerts).replay(AlertRegistry, AlertRegistry.apply))
+
+    periods = sorted(set(alert.time_period for alert in alerts)) or ['1d']
+    prepost = sorted(set(alert.pre_post_data for alert in alerts)) or [False]
+    recording = list(bar_quotes(bars, periods, prepost))
+    backtest = Backtest(alerts)
+    report = asyncio.get_event_loop().run_until_complete(backtest.run(ReplaySource(recording)))
+    print(f'{len(alerts)} alerts on {bars["ticker"].nunique()} tickers')
+    print(report)
+    by_type = pd.Series([fired.alert.type for fired in backtest.sink], dtype=object).value_counts()
+    for alert_type, count in by_type.items():
+        print(f'{alert_type}: {count} fired')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import pytz
+
+from cogs.utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str, bool]  # (ticker, period, interval, prepost)
+
+MARKET_TZ = pytz.timezone('America/New_York')
+
+# How long a frame of each bar size stays fresh. Anything not listed (1d, 5d, 1wk, 1mo, 3mo) only changes once
+# per session and is kept until the next market close.
+INTERVAL_TTLS = {
+    '1m': 60,
+    '2m': 2 * 60,
+    '5m': 5 * 60,
+    '15m': 15 * 60,
+    '30m': 30 * 60,
+    '60m': 60 * 60,
+    '90m': 90 * 60,
+    '1h': 60 * 60,
+}
+
+
+def seconds_until_close(now: Optional[datetime] = None) -> float:
+    now = now or datetime.now(MARKET_TZ)
+    close = now.replace(hour=16, minute=0, second=0, microsecond=0)
+    if close <= now:
+        close += timedelta(days=1)
+    return (close - now).total_seconds()
+
+
+def ttl(interval: str) -> float:
+    return INTERVAL_TTLS.get(interval) or seconds_until_close()
+
+
+class PriceCache:
+    """Process wide LRU cache of per ticker OHLC frames keyed by (ticker, period, interval, prepost).
+
+    Entries expire after the ttl of their bar interval and the least recently used frames are evicted once
+    the estimated size of all cached frames passes max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[CacheKey, Tuple[pd.DataFrame, float, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: CacheKey) -> Optional['pd.DataFrame']:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            frame, expires, nbytes = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.size -= nbytes
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key: CacheKey, frame: 'pd.DataFrame'):
+        nbytes = int(frame.memory_usage(index=True).sum())
+        expires = time.monotonic() + ttl(key[2])
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._entries[key] = (frame, expires, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                evicted, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.size -= evicted_bytes
+                logger.debug(f'Evicted {evicted} from price cache')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+price_cache = PriceCache()
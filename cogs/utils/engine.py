@@ -0,0 +1,151 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cogs.utils.feeds import Quote
+
+QuoteKey = Tuple[str, str, bool]  # (ticker, period, prepost)
+
+PERCENT, DOLLAR, ABOVE, BELOW = range(4)
+TYPE_CODES = {'%': PERCENT, '$': DOLLAR, 'Above': ABOVE, 'Below': BELOW}
+
+
+class Evaluation(NamedTuple):
+    fired: np.ndarray  # alert indices that triggered
+    price: np.ndarray  # price each fired alert triggered at
+    change: np.ndarray  # change each fired alert triggered on, the price itself for Above/Below alerts
+    reset: np.ndarray  # alert indices whose last_alert was cleared
+
+
+class AlertColumns:
+    """The alert book stored as columnar arrays so a whole tick is evaluated with a handful of numpy operations.
+
+    Every alert points at a quote, the (ticker, period, prepost) combination it is evaluated against. A tick
+    supplies the latest price, the first price of the period (the baseline for change alerts) and whether the
+    quote is from the current session, one value per quote.
+    """
+
+    def __init__(self, alerts: Sequence, version: int = 0):
+        self.alerts = list(alerts)
+        self.version = version
+        self.keys: List[QuoteKey] = []
+        index: Dict[QuoteKey, int] = {}
+        quote = []
+        for alert in self.alerts:
+            key = (alert.ticker.upper(), alert.time_period, alert.pre_post_data)
+            if key not in index:
+                index[key] = len(self.keys)
+                self.keys.append(key)
+            quote.append(index[key])
+        self.index = index
+        self.quote = np.array(quote, dtype=np.int64)
+        self.type = np.array([TYPE_CODES.get(alert.type, -1) for alert in self.alerts], dtype=np.int8)
+        self.value = np.array([alert.value for alert in self.alerts], dtype=np.float64)
+        self.last = np.array([np.nan if alert.last_alert is None else alert.last_alert for alert in self.alerts],
+                             dtype=np.float64)
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def evaluate(self, price: np.ndarray, baseline: np.ndarray, fresh: np.ndarray,
+                 touched: Optional[np.ndarray] = None) -> Evaluation:
+        """Evaluate alerts against per quote price, baseline and fresh arrays (NaN price = no data), limited to
+        alerts on touched quotes if given. Alerts on quotes that aren't fresh are reset.
+
+        Updates the last column in place and returns what changed so it can be written back to the alerts.
+        """
+        price = price[self.quote]
+        baseline = baseline[self.quote]
+        considered = ~np.isnan(price) if touched is None else touched[self.quote]
+        # A quote from outside the current session resets alerts even when it carries no price
+        stale = considered & ~fresh[self.quote]
+        live = considered & ~stale & ~np.isnan(price)
+        unset = np.isnan(self.last)
+
+        prev = np.where(unset, baseline, self.last)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = np.round(100 * (price - prev) / prev, 2)
+        dollar = np.round(price - prev, 2)
+        change = np.where(self.type == PERCENT, percent, np.where(self.type == DOLLAR, dollar, price))
+
+        is_change = (self.type == PERCENT) | (self.type == DOLLAR)
+        above = self.type == ABOVE
+        below = self.type == BELOW
+        fired = live & ((is_change & (np.abs(change) > self.value)) |
+                        (above & unset & (price > self.value)) |
+                        (below & unset & (price < self.value)))
+        cleared = live & ~unset & ((above & (price < self.value)) | (below & (price > self.value)))
+        reset = (stale & ~unset) | cleared
+
+        self.last[fired] = price[fired]
+        self.last[reset] = np.nan
+        fired = np.flatnonzero(fired)
+        return Evaluation(fired=fired, price=price[fired], change=change[fired], reset=np.flatnonzero(reset))
+
+
+class AlertEngine:
+    """Alert columns together with the latest price, baseline and freshness of every quote they reference.
+
+    Quotes from any price source are applied with update and only alerts on the quotes that moved are evaluated.
+    A live tick has no period, it moves every quote of its ticker (only the pre/post market ones if the tick is
+    from outside regular hours) and keeps the baselines from the last poll.
+    """
+
+    def __init__(self):
+        self.columns = AlertColumns([], version=-1)
+        self.price = np.empty(0)
+        self.baseline = np.empty(0)
+        self.fresh = np.empty(0, dtype=bool)
+        self.by_ticker: Dict[str, List[int]] = {}
+
+    @property
+    def version(self) -> int:
+        return self.columns.version
+
+    @property
+    def tickers(self) -> List[str]:
+        return list(self.by_ticker)
+
+    def load(self, alerts: Sequence, version: int):
+        """Rebuild the columns from the alert book, carrying over quotes that are still referenced"""
+        old = self.columns
+        price, baseline, fresh = self.price, self.baseline, self.fresh
+        self.columns = AlertColumns(alerts, version)
+        size = len(self.columns.keys)
+        self.price = np.full(size, np.nan)
+        self.baseline = np.full(size, np.nan)
+        self.fresh = np.zeros(size, dtype=bool)
+        self.by_ticker = {}
+        for quote, key in enumerate(self.columns.keys):
+            self.by_ticker.setdefault(key[0], []).append(quote)
+            previous = old.index.get(key)
+            if previous is not None:
+                self.price[quote] = price[previous]
+                self.baseline[quote] = baseline[previous]
+                self.fresh[quote] = fresh[previous]
+
+    def update(self, quotes: Iterable[Quote]) -> np.ndarray:
+        """Apply quotes and return a mask of the quote keys they touched"""
+        touched = np.zeros(len(self.columns.keys), dtype=bool)
+        for quote in quotes:
+            ticker = quote.ticker.upper()
+            if quote.period is not None:
+                index = self.columns.index.get((ticker, quote.period, quote.prepost))
+                if index is None:
+                    continue
+                if not np.isnan(quote.price):
+                    self.price[index] = quote.price
+                    self.baseline[index] = np.nan if quote.baseline is None else quote.baseline
+                self.fresh[index] = quote.fresh
+                touched[index] = True
+            else:
+                for index in self.by_ticker.get(ticker, ()):
+                    if quote.prepost and not self.columns.keys[index][2]:
+                        continue
+                    self.price[index] = quote.price
+                    self.fresh[index] = quote.fresh
+                    touched[index] = True
+        return touched
+
+    def evaluate(self, touched: Optional[np.ndarray] = None) -> Evaluation:
+        return self.columns.evaluate(self.price, self.baseline, self.fresh, touched)
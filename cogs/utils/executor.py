@@ -0,0 +1,26 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class IOExecutor:
+    """Bounded thread pool for blocking network and disk calls (yfinance, boto3, pickle files).
+
+    Coroutines await `run` instead of calling the blocking function directly so the discord gateway
+    heartbeat keeps running while a download or upload is in progress.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='io')
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = False):
+        logger.info(f'Shutting down io executor')
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,242 @@
+import asyncio
+import base64
+import json
+import logging
+import random
+import struct
+import time
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, NamedTuple, Optional, Set
+
+import aiohttp
+
+from cogs.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+poll_seconds = metrics.histogram('poll_seconds', 'Seconds a polling source\'s poll took')
+poll_overruns = metrics.counter('poll_overruns_total', 'Polls that took longer than the polling interval')
+
+
+class Quote(NamedTuple):
+    ticker: str
+    price: float
+    time: float  # epoch seconds
+    period: Optional[str] = None  # None for a live tick, which applies to every period of the ticker
+    prepost: bool = False  # for a live tick, whether it is from the pre/post market session
+    baseline: Optional[float] = None  # first price of the period, only known to polled quotes
+    fresh: bool = True  # whether the quote is from the current session
+
+
+class PriceSource:
+    """Something that produces batches of quotes for the alert engine to evaluate"""
+
+    def quotes(self) -> AsyncIterator[List[Quote]]:
+        raise NotImplementedError
+
+    def subscribe(self, tickers: Iterable[str]):
+        """Replace the set of tickers the source should watch. Sources that are told what to fetch ignore this."""
+
+    def stop(self):
+        pass
+
+
+class PollingSource(PriceSource):
+    """Calls poll every seconds seconds and yields whatever quotes it returns"""
+
+    def __init__(self, poll: Callable[[], Awaitable[List[Quote]]], seconds: float = 60):
+        self.poll = poll
+        self.seconds = seconds
+
+    async def quotes(self) -> AsyncIterator[List[Quote]]:
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            try:
+                quotes = await self.poll()
+            except Exception as e:
+                logger.exception(f'Polling failed: {e}')
+                quotes = []
+            elapsed = loop.time() - start
+            poll_seconds.observe(elapsed)
+            if elapsed > self.seconds:
+                poll_overruns.inc()
+                logger.warning(f'Poll took {elapsed:.1f}s, longer than its {self.seconds}s interval')
+            if quotes:
+                yield quotes
+            await asyncio.sleep(max(0.0, self.seconds - (loop.time() - start)))
+
+
+class StreamingSource(PriceSource):
+    """Push based source. Producers push quotes as they arrive and consumers get everything queued since
+    their last batch, so a slow consumer evaluates bigger batches instead of falling behind.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.tickers: Set[str] = set()
+
+    def subscribe(self, tickers: Iterable[str]):
+        self.tickers = set(ticker.upper() for ticker in tickers)
+
+    def push(self, quote: Quote):
+        if self.queue.full():
+            # Only the latest price of a ticker matters, so the oldest tick is the one to drop
+            self.queue.get_nowait()
+        self.queue.put_nowait(quote)
+
+    async def quotes(self) -> AsyncIterator[List[Quote]]:
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            yield batch
+
+
+class ReplaySource(StreamingSource):
+    """Replays recorded quotes, spaced by their recorded times divided by speed (None = as fast as possible).
+    Consecutive quotes with the same time are yielded as one batch, like a poll returning a whole group.
+
+    Stops once the recording is exhausted, so consumers can run it to completion.
+    """
+
+    def __init__(self, recording: Iterable[Quote], speed: Optional[float] = None):
+        super().__init__(maxsize=0)
+        self.recording = recording
+        self.speed = speed
+
+    async def quotes(self) -> AsyncIterator[List[Quote]]:
+        previous = None
+        batch = []
+        for quote in self.recording:
+            if batch and quote.time != previous:
+                yield batch
+                batch = []
+                if self.speed is not None and quote.time > previous:
+                    await asyncio.sleep((quote.time - previous) / self.speed)
+            previous = quote.time
+            batch.append(quote)
+        if batch:
+            yield batch
+
+
+class YahooStreamingSource(StreamingSource):
+    """Live ticks from yahoo's (unofficial) websocket streamer.
+
+    The streamer takes {"subscribe": [tickers]} and sends base64 encoded protobuf PricingData messages. Only the
+    id, price, time and marketHours fields are needed, so they are decoded by hand instead of pulling in protobuf.
+    """
+
+    url = 'wss://streamer.finance.yahoo.com/'
+    # MarketHoursType values. proto3 leaves zero values off the wire, so a message without one is pre-market.
+    PRE_MARKET = 0
+    REGULAR_MARKET = 1
+
+    def __init__(self, maxsize: int = 10000):
+        super().__init__(maxsize)
+        self._task = None
+        self._resubscribe = asyncio.Event()
+
+    def subscribe(self, tickers: Iterable[str]):
+        tickers = set(ticker.upper() for ticker in tickers)
+        if tickers != self.tickers:
+            super().subscribe(tickers)
+            self._resubscribe.set()
+
+    async def quotes(self) -> AsyncIterator[List[Quote]]:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.connect())
+        async for batch in super().quotes():
+            yield batch
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def connect(self):
+        delay = 1
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(self.url, heartbeat=30) as ws:
+                        logger.info(f'Connected to yahoo streamer')
+                        delay = 1
+                        await self._listen(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Yahoo streamer disconnected: {e}')
+            await asyncio.sleep(delay + random.random())
+            delay = min(delay * 2, 60)
+
+    async def _listen(self, ws):
+        subscribed: Set[str] = set()
+        while True:
+            if self.tickers != subscribed:
+                if subscribed - self.tickers:
+                    await ws.send_str(json.dumps({'unsubscribe': sorted(subscribed - self.tickers)}))
+                await ws.send_str(json.dumps({'subscribe': sorted(self.tickers)}))
+                subscribed = set(self.tickers)
+            self._resubscribe.clear()
+
+            receive = asyncio.ensure_future(ws.receive())
+            resubscribe = asyncio.ensure_future(self._resubscribe.wait())
+            done, _ = await asyncio.wait([receive, resubscribe], return_when=asyncio.FIRST_COMPLETED)
+            resubscribe.cancel()
+            if receive not in done:
+                receive.cancel()
+                continue
+            message = receive.result()
+            if message.type != aiohttp.WSMsgType.TEXT:
+                return
+            quote = decode_pricing_data(base64.b64decode(message.data))
+            if quote is not None:
+                self.push(quote)
+
+
+def _varint(data: bytes, pos: int):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def decode_pricing_data(data: bytes) -> Optional[Quote]:
+    """Decode the fields of a yahoo PricingData protobuf message the alert engine uses"""
+    fields = {}
+    pos = 0
+    try:
+        while pos < len(data):
+            key, pos = _varint(data, pos)
+            number, wire_type = key >> 3, key & 7
+            if wire_type == 0:
+                fields[number], pos = _varint(data, pos)
+            elif wire_type == 1:
+                fields[number] = data[pos:pos + 8]
+                pos += 8
+            elif wire_type == 2:
+                length, pos = _varint(data, pos)
+                fields[number] = data[pos:pos + length]
+                pos += length
+            elif wire_type == 5:
+                fields[number] = data[pos:pos + 4]
+                pos += 4
+            else:
+                return None
+    except IndexError:
+        return None
+
+    if 1 not in fields or 2 not in fields:
+        return None
+    ticker = fields[1].decode()
+    price = struct.unpack('<f', fields[2])[0]
+    raw_time = fields.get(3, 0)
+    millis = (raw_time >> 1) ^ -(raw_time & 1)  # sint64 is zigzag encoded
+    market_hours = fields.get(7, YahooStreamingSource.PRE_MARKET)
+    return Quote(ticker=ticker,
+                 price=float(price),
+                 time=millis / 1000 if millis else time.time(),
+                 prepost=market_hours != YahooStreamingSource.REGULAR_MARKET)
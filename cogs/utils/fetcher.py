@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+from cogs.utils.executor import IOExecutor
+from cogs.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ticker_seconds = metrics.histogram('fetch_ticker_seconds', 'Seconds until a ticker\'s bars arrived, batch or single')
+fetch_failures = metrics.counter('fetch_failures_total', 'Tickers that could not be fetched')
+
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts of up to burst requests"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Stops requests for a key after threshold consecutive failures.
+
+    The circuit stays open for cooldown seconds, doubling every time it re-opens up to max_cooldown. Once the
+    cooldown is over a single attempt goes through, success closes the circuit again.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 60, max_cooldown: float = 60 * 60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures: Dict[Hashable, int] = {}
+        self.open_until: Dict[Hashable, float] = {}
+        self.trips: Dict[Hashable, int] = {}
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        return self.open_until.get(key, 0) <= (now or time.monotonic())
+
+    def success(self, key: Hashable):
+        self.failures.pop(key, None)
+        self.open_until.pop(key, None)
+        self.trips.pop(key, None)
+
+    def failure(self, key: Hashable, now: Optional[float] = None):
+        self.failures[key] = self.failures.get(key, 0) + 1
+        if self.failures[key] >= self.threshold:
+            trips = self.trips.get(key, 0)
+            cooldown = min(self.cooldown * 2 ** trips, self.max_cooldown)
+            self.open_until[key] = (now or time.monotonic()) + cooldown
+            self.trips[key] = trips + 1
+            self.failures[key] = self.threshold - 1  # a failed half-open attempt re-opens immediately
+            logger.warning(f'Circuit open for {key} for {cooldown:.0f}s')
+
+
+class Fetcher:
+    """Runs downloads concurrently on the io executor.
+
+    At most concurrency downloads are in flight and they are started no faster than the token bucket allows.
+    Failed batch downloads are retried with jittered exponential backoff. When a batched download fails or comes
+    back without some tickers, those tickers get a single attempt each, concurrently and without backoff, so a
+    bad ticker costs a scan at most one extra download. Tickers that keep failing are then skipped by a per
+    ticker circuit breaker instead of being retried inside the scan.
+    """
+
+    def __init__(self, io: IOExecutor, concurrency: int = 4, rate: float = 2, burst: int = 5, retries: int = 3,
+                 base_delay: float = 1, max_delay: float = 30, breaker: Optional[CircuitBreaker] = None):
+        self.io = io
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = TokenBucket(rate, burst)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+
+    async def call(self, func: Callable, *args, retries: Optional[int] = None, **kwargs):
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                async with self.semaphore:
+                    await self.limiter.acquire()
+                    if asyncio.iscoroutinefunction(func):
+                        return await func(*args, **kwargs)
+                    return await self.io.run(func, *args, **kwargs)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f'{getattr(func, "__name__", func)} failed ({e}), retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
+    async def fetch(self, fetch: Callable[..., Dict[str, object]], tickers: List[str], **kwargs) -> Dict[str, object]:
+        """Call fetch(tickers, **kwargs), which returns {ticker: frame}, and fall back to one ticker at a time
+        for the tickers it didn't return"""
+        allowed = [ticker for ticker in tickers if self.breaker.allow(ticker)]
+        if len(allowed) < len(tickers):
+            logger.info(f'Skipping {len(tickers) - len(allowed)} tickers with open circuits')
+        if not allowed:
+            return {}
+
+        try:
+            frames = await self.timed(fetch, allowed, **kwargs)
+        except Exception as e:
+            logger.warning(f'Batch of {len(allowed)} tickers failed: {e}')
+            frames = {}
+
+        missing = [ticker for ticker in allowed if ticker not in frames]
+        if missing and len(allowed) > 1:
+            singles = await asyncio.gather(*(self.timed(fetch, [ticker], retries=0, **kwargs)
+                                             for ticker in missing),
+                                           return_exceptions=True)
+            for ticker, result in zip(missing, singles):
+                if isinstance(result, Exception):
+                    logger.warning(f'Could not download {ticker}: {result}')
+                elif ticker in result:
+                    frames[ticker] = result[ticker]
+
+        for ticker in allowed:
+            if ticker in frames:
+                self.breaker.success(ticker)
+            else:
+                self.breaker.failure(ticker)
+                fetch_failures.inc()
+        return frames
+
+    async def timed(self, fetch: Callable[..., Dict[str, object]], tickers: List[str], retries: Optional[int] = None,
+                    **kwargs) -> Dict[str, object]:
+        start = time.perf_counter()
+        frames = dict(await self.call(fetch, tickers, retries=retries, **kwargs))
+        elapsed = time.perf_counter() - start
+        for _ in frames:
+            ticker_seconds.observe(elapsed)
+        return frames
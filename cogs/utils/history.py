@@ -0,0 +1,131 @@
+import logging
+import threading
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from cogs.utils import prices
+from cogs.utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+HistoryKey = Tuple[str, str, bool]  # (ticker, interval, prepost)
+
+# Periods ordered by how far back they reach, used to tell when stored bars don't cover a request
+PERIODS = ['1d', '5d', '1mo', '3mo', '6mo', 'ytd', '1y', '2y', '5y', '10y', 'max']
+
+# pd.DateOffset arguments, kept as plain dicts so pandas isn't needed to import this module
+PERIOD_OFFSETS = {
+    '1d': {'days': 1},
+    '5d': {'days': 5},
+    '1mo': {'months': 1},
+    '3mo': {'months': 3},
+    '6mo': {'months': 6},
+    '1y': {'years': 1},
+    '2y': {'years': 2},
+    '5y': {'years': 5},
+    '10y': {'years': 10},
+}
+
+
+def period_start(period: str, now: 'pd.Timestamp') -> Optional['pd.Timestamp']:
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return now.normalize().replace(month=1, day=1)
+    return now.normalize() - pd.DateOffset(**PERIOD_OFFSETS[period])
+
+
+class HistoryStore:
+    """Bars already seen per (ticker, interval, prepost).
+
+    The first request for a ticker downloads the whole period. After that each update only asks yahoo for bars
+    from the last stored bar onwards (start=/end= instead of period=), and the stored bars are sliced back down
+    to the requested period. The last stored bar is always re-fetched since it is still moving until the
+    session closes.
+    """
+
+    # Only daily bars are worth keeping, intraday periods are short enough to re-download through the cache
+    intervals = {'1d'}
+
+    def __init__(self):
+        self._bars: Dict[HistoryKey, 'pd.DataFrame'] = {}
+        self._periods: Dict[HistoryKey, str] = {}
+        self._lock = threading.Lock()
+
+    def window(self, tickers: Iterable[str], period: str, interval: str,
+               prepost: bool = False) -> Dict[str, 'pd.DataFrame']:
+        """Per ticker frames covering period, fetching only bars that aren't stored yet. Blocking.
+
+        The lock is only held to read and merge stored bars, so windows of different groups download in parallel.
+        """
+        tickers = sorted(set(ticker.upper() for ticker in tickers))
+        backfill = []
+        tails = {}
+        with self._lock:
+            for ticker in tickers:
+                key = (ticker, interval, prepost)
+                covered = self._periods.get(key)
+                if covered is None or PERIODS.index(covered) < PERIODS.index(period):
+                    backfill.append(ticker)
+                else:
+                    tails.setdefault(self._bars[key].index[-1].date(), []).append(ticker)
+
+        if backfill:
+            data = prices.download(' '.join(backfill),
+                                   period=period,
+                                   interval=interval,
+                                   group_by='ticker',
+                                   prepost=prepost)
+            frames = prices.split(data, backfill)
+            with self._lock:
+                for ticker, frame in frames.items():
+                    self.store((ticker, interval, prepost), frame, period)
+
+        for start, group in tails.items():
+            data = prices.download(' '.join(group),
+                                   start=start.isoformat(),
+                                   end=(pd.Timestamp.now().date() + timedelta(days=1)).isoformat(),
+                                   interval=interval,
+                                   group_by='ticker',
+                                   prepost=prepost)
+            frames = prices.split(data, group)
+            with self._lock:
+                for ticker, frame in frames.items():
+                    key = (ticker, interval, prepost)
+                    # Dropped by retain() while downloading, a tail alone doesn't cover the period
+                    if key in self._bars:
+                        self.merge(key, frame)
+
+        frames = {}
+        with self._lock:
+            for ticker in tickers:
+                bars = self._bars.get((ticker, interval, prepost))
+                if bars is None:
+                    continue
+                start = period_start(period, pd.Timestamp.now(tz=bars.index.tz))
+                frames[ticker] = bars if start is None else bars[bars.index >= start]
+        return frames
+
+    def store(self, key: HistoryKey, frame: 'pd.DataFrame', period: str):
+        """Keep a download of the whole period, merged into stored bars that may have been updated meanwhile"""
+        covered = self._periods.get(key)
+        if covered is None:
+            self._bars[key] = frame
+        else:
+            self.merge(key, frame)
+        if covered is None or PERIODS.index(covered) < PERIODS.index(period):
+            self._periods[key] = period
+
+    def merge(self, key: HistoryKey, frame: 'pd.DataFrame'):
+        bars = pd.concat([self._bars[key], frame])
+        self._bars[key] = bars[~bars.index.duplicated(keep='last')].sort_index()
+
+    def retain(self, keys: Iterable[HistoryKey]):
+        """Forget the bars of every key not in keys, so tickers nobody alerts on anymore don't stay in memory"""
+        keys = set(keys)
+        with self._lock:
+            for key in self._bars.keys() - keys:
+                del self._bars[key]
+                del self._periods[key]
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any, Awaitable, Callable, Iterable, List, Tuple
+
+from cogs.utils.records import Record, RecordArrays
+
+logger = logging.getLogger(__name__)
+
+Entry = Tuple  # (seq, op, *args)
+
+
+def apply(items: List, record: Entry):
+    """Apply a single journal record to a list of records"""
+    _, op, *args = record
+    if op == 'append':
+        items.append(args[0])
+    elif op == 'delete':
+        del items[args[0]]
+    elif op == 'clear':
+        items.clear()
+    elif op == 'set':
+        index, field, value = args
+        setattr(items[index], field, value)
+    else:
+        raise ValueError(f'Unknown journal op {op}')
+
+
+class Journal:
+    """Append only write ahead log of changes to a list, periodically compacted into a pickled snapshot.
+
+    Every record carries a sequence number and the snapshot stores the last sequence number it includes, so
+    replaying a snapshot together with a journal that wasn't truncated yet never applies a change twice.
+    """
+
+    def __init__(self, snapshot_file: str, compact_every: int = 500):
+        self.snapshot_file = snapshot_file
+        self.journal_file = os.path.splitext(snapshot_file)[0] + '.log'
+        self.compact_every = compact_every
+        self.seq = 0
+        self.pending = 0  # records written since the last compaction
+        self.snapshot_seq = 0  # sequence number of the snapshot file
+        self.compacting = False  # set while a snapshot is being written, so only one is at a time
+        self._lock = threading.Lock()
+
+    @property
+    def files(self) -> List[str]:
+        return [self.snapshot_file, self.journal_file]
+
+    def append(self, *ops: Tuple):
+        with open(self.journal_file, 'ab') as f:
+            for op in ops:
+                self.seq += 1
+                pickle.dump((self.seq, *op), f, pickle.HIGHEST_PROTOCOL)
+        self.pending += len(ops)
+
+    @property
+    def needs_compaction(self) -> bool:
+        return not self.compacting and self.pending >= self.compact_every
+
+    def snapshot(self, items: Iterable) -> Tuple[int, List]:
+        """Copy of the list of items as of the current sequence number, to pass to write_snapshot.
+
+        Only the list is copied, so a record changed after this is written with its newer value. Replaying the
+        journal sets it to that value again, which is why only whole record changes have to be copied here.
+        """
+        self.pending = 0
+        return self.seq, list(items)
+
+    def write_snapshot(self, seq: int, items: List) -> bool:
+        """Serialize items and atomically replace the snapshot file with them, unless it is already newer.
+
+        Blocking, meant to run on the io executor. Returns whether the snapshot was written.
+        """
+        if items and isinstance(items[0], Record):
+            items = RecordArrays.from_records(items)
+        data = pickle.dumps((seq, items), pickle.HIGHEST_PROTOCOL)
+        directory, name = os.path.split(self.snapshot_file)
+        fd, tmp = tempfile.mkstemp(prefix=f'{name}.', suffix='.tmp', dir=directory or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            with self._lock:
+                if seq < self.snapshot_seq:
+                    logger.warning(f'Skipped snapshot of {self.journal_file} at {seq}, {self.snapshot_seq} is '
+                                   f'already written')
+                    return False
+                os.replace(tmp, self.snapshot_file)
+                self.snapshot_seq = seq
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        logger.info(f'Compacted {self.journal_file} into {self.snapshot_file} at {seq}')
+        return True
+
+    def truncate(self, seq: int):
+        """Drop the records the snapshot at seq includes, keeping any appended since it was taken"""
+        if self.seq == seq:
+            open(self.journal_file, 'wb').close()
+            return
+        newer = [record for record in self.records() if record[0] > seq]
+        tmp = f'{self.journal_file}.tmp'
+        with open(tmp, 'wb') as f:
+            for record in newer:
+                pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.journal_file)
+
+    def replay(self, build: Callable[[List], Any] = list, apply: Callable[[Any, Entry], None] = apply) -> Any:
+        """Rebuild state from the snapshot and journal.
+
+        build turns the snapshot's list into the state object and apply applies one record to that object.
+        """
+        items, seq = [], 0
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'rb') as f:
+                snapshot = pickle.load(f)
+            # Snapshots written before the journal existed are a bare list
+            seq, items = (0, snapshot) if isinstance(snapshot, list) else snapshot
+            if isinstance(items, RecordArrays):
+                items = items.to_records()
+        self.snapshot_seq = seq
+        items = build(items)
+        count = 0
+        for record in self.records():
+            if record[0] > seq:
+                apply(items, record)
+                seq = record[0]
+                count += 1
+        self.seq = seq
+        self.pending = count
+        logger.info(f'Replayed {count} records from {self.journal_file}')
+        return items
+
+    def records(self) -> Iterable[Entry]:
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+                except Exception:
+                    # A torn write at the end of the log, everything before it is still good
+                    logger.warning(f'Truncated record at end of {self.journal_file}')
+                    return
+
+
+class Debouncer:
+    """Collects keys and flushes them together once no new key has arrived for delay seconds.
+
+    A steady stream of changes can't postpone a flush for more than max_delay seconds.
+    """
+
+    def __init__(self, flush: Callable[[List[Any]], Awaitable], delay: float = 30, max_delay: float = 300):
+        self.flush = flush
+        self.delay = delay
+        self.max_delay = max_delay
+        self.pending = set()
+        self._first = None
+        self._deadline = None
+        self._task = None
+
+    def schedule(self, *keys):
+        now = asyncio.get_event_loop().time()
+        self.pending.update(keys)
+        self._deadline = now + self.delay
+        if self._first is None:
+            self._first = now
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while self.pending:
+            wait = min(self._deadline, self._first + self.max_delay) - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                await self.drain()
+
+    async def drain(self):
+        keys, self.pending, self._first = sorted(self.pending), set(), None
+        if keys:
+            await self.flush(keys)
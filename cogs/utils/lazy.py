@@ -0,0 +1,21 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand in for a module that is only imported the first time one of its attributes is used.
+
+    Lets the bot connect before pandas, yfinance and boto3 are loaded; the first use is usually a download on an
+    executor thread, so the import happens off the event loop. Annotations that name these modules have to be
+    strings, or defining the function would trigger the import.
+    """
+
+    def __getattr__(self, name: str):
+        module = importlib.import_module(self.__name__)
+        # Later lookups find the attributes directly instead of coming back through here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    return LazyModule(name)
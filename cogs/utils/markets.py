@@ -0,0 +1,183 @@
+import logging
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Set
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+
+class Exchange(NamedTuple):
+    name: str
+    tz: str
+    open: time
+    close: time
+    pre_open: Optional[time] = None  # start of pre market trading, None if the exchange has none
+    post_close: Optional[time] = None  # end of post market trading
+    always_open: bool = False  # crypto
+    weekdays_only: bool = True
+    us_holidays: bool = False
+
+
+NYSE = Exchange('NYSE', 'America/New_York', time(9, 30), time(16), time(4), time(20), us_holidays=True)
+CRYPTO = Exchange('Crypto', 'UTC', time(0), time(0), always_open=True, weekdays_only=False)
+# FX and futures trade around the clock from Sunday evening to Friday evening, approximated as 24/5 in eastern time
+FOREX = Exchange('Forex', 'America/New_York', time(0), time(0), always_open=True)
+FUTURES = Exchange('Futures', 'America/Chicago', time(0), time(0), always_open=True)
+
+# Yahoo ticker suffixes of the exchanges people actually set alerts on. Only US holidays are modeled, other
+# exchanges are only closed on weekends.
+SUFFIXES: Dict[str, Exchange] = {
+    '.TO': Exchange('TSX', 'America/Toronto', time(9, 30), time(16)),
+    '.V': Exchange('TSXV', 'America/Toronto', time(9, 30), time(16)),
+    '.L': Exchange('LSE', 'Europe/London', time(8), time(16, 30)),
+    '.DE': Exchange('XETRA', 'Europe/Berlin', time(9), time(17, 30)),
+    '.F': Exchange('Frankfurt', 'Europe/Berlin', time(8), time(20)),
+    '.PA': Exchange('Euronext Paris', 'Europe/Paris', time(9), time(17, 30)),
+    '.AS': Exchange('Euronext Amsterdam', 'Europe/Amsterdam', time(9), time(17, 30)),
+    '.SW': Exchange('SIX', 'Europe/Zurich', time(9), time(17, 30)),
+    '.HK': Exchange('HKEX', 'Asia/Hong_Kong', time(9, 30), time(16)),
+    '.T': Exchange('TSE', 'Asia/Tokyo', time(9), time(15)),
+    '.AX': Exchange('ASX', 'Australia/Sydney', time(10), time(16)),
+}
+
+CRYPTO_QUOTES = ('-USD', '-USDT', '-USDC', '-BTC', '-ETH', '-EUR', '-GBP')
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """n-th (1 based, -1 = last) weekday (0 = Monday) of a month"""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year: int) -> date:
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(day: date) -> Optional[date]:
+    """Saturday holidays are observed on Friday and Sunday holidays on Monday. NYSE doesn't move a Saturday New
+    Year's Day back into the previous year, so that case isn't observed at all."""
+    if day.weekday() == 5:
+        return None if (day.month, day.day) == (1, 1) else day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def us_holidays(year: int) -> Set[date]:
+    days = {
+        _observed(date(year, 1, 1)),
+        _nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),
+    }
+    if year >= 2022:
+        days.add(_observed(date(year, 6, 19)))  # Juneteenth
+    return {day for day in days if day is not None}
+
+
+@lru_cache(maxsize=None)
+def us_early_closes(year: int) -> Set[date]:
+    """Days NYSE closes at 13:00: July 3rd, the day after Thanksgiving and Christmas Eve, when they are trading
+    days"""
+    days = {date(year, 7, 3), _nth_weekday(year, 11, 3, 4) + timedelta(days=1), date(year, 12, 24)}
+    return {day for day in days if day.weekday() < 5 and day not in us_holidays(year)}
+
+
+class MarketCalendar:
+    """Trading sessions of the exchange behind a yahoo ticker.
+
+    Covers regular hours, pre/post market windows and US holidays and early closes for US listings, weekday only
+    sessions for other exchanges, and 24/7 trading for crypto pairs.
+    """
+
+    def exchange(self, ticker: str) -> Exchange:
+        ticker = ticker.upper()
+        if ticker.endswith(CRYPTO_QUOTES):
+            return CRYPTO
+        if ticker.endswith('=X'):
+            return FOREX
+        if ticker.endswith('=F'):
+            return FUTURES
+        for suffix, exchange in SUFFIXES.items():
+            if ticker.endswith(suffix):
+                return exchange
+        return NYSE
+
+    def is_trading_day(self, exchange: Exchange, day: date) -> bool:
+        if exchange.weekdays_only and day.weekday() >= 5:
+            return False
+        return not (exchange.us_holidays and day in us_holidays(day.year))
+
+    def hours(self, exchange: Exchange, day: date, prepost: bool = False):
+        """(start, end) local times of the session on day"""
+        start = exchange.pre_open if prepost and exchange.pre_open else exchange.open
+        end = exchange.post_close if prepost and exchange.post_close else exchange.close
+        if exchange.us_holidays and day in us_early_closes(day.year):
+            end = time(17) if prepost else time(13)
+        return start, end
+
+    def local(self, exchange: Exchange, now: datetime) -> datetime:
+        return now.astimezone(pytz.timezone(exchange.tz))
+
+    def today(self, ticker: str, now: Optional[datetime] = None) -> date:
+        """Exchange local date"""
+        return self.local(self.exchange(ticker), now or datetime.now(pytz.utc)).date()
+
+    def is_open(self, ticker: str, prepost: bool = False, now: Optional[datetime] = None) -> bool:
+        exchange = self.exchange(ticker)
+        local = self.local(exchange, now or datetime.now(pytz.utc))
+        if not self.is_trading_day(exchange, local.date()):
+            return False
+        if exchange.always_open:
+            return True
+        start, end = self.hours(exchange, local.date(), prepost)
+        return start <= local.time() < end
+
+    def next_open(self, ticker: str, prepost: bool = False, now: Optional[datetime] = None) -> datetime:
+        """Start of the current session if one is in progress, otherwise of the next one"""
+        now = now or datetime.now(pytz.utc)
+        if self.is_open(ticker, prepost, now):
+            return now
+        exchange = self.exchange(ticker)
+        tz = pytz.timezone(exchange.tz)
+        local = self.local(exchange, now)
+        day = local.date()
+        for _ in range(15):
+            if self.is_trading_day(exchange, day):
+                start, _ = self.hours(exchange, day, prepost)
+                opens = tz.localize(datetime.combine(day, start))
+                if opens > local:
+                    return opens
+            day += timedelta(days=1)
+        logger.warning(f'No session for {ticker} in the next two weeks')
+        return now + timedelta(days=1)
+
+    def bar_date(self, ticker: str, timestamp) -> date:
+        """Exchange local date of a bar. Intraday bars are tz aware, daily bars are already a local date."""
+        if getattr(timestamp, 'tzinfo', None) is None:
+            return timestamp.date()
+        return self.local(self.exchange(ticker), timestamp).date()
+
+
+calendar = MarketCalendar()
@@ -0,0 +1,127 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Union
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cached lookup up to a poll that overran its whole interval
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self) -> List[str]:
+        return [f'{self.name} {self.value}']
+
+    def summary(self) -> str:
+        return f'{self.value:g}'
+
+
+class Histogram:
+    """Counts of observations per bucket, cumulative only when rendered, so observing is a bisect and an add"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float) -> float:
+        """Estimate from the buckets, interpolating linearly inside the bucket the quantile falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def samples(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_sum {self.sum}')
+        lines.append(f'{self.name}_count {self.count}')
+        return lines
+
+    def summary(self) -> str:
+        if not self.count:
+            return 'no data'
+        return (f'n={self.count} mean={self.sum / self.count * 1000:.1f}ms '
+                f'p50={self.quantile(0.5) * 1000:.1f}ms p95={self.quantile(0.95) * 1000:.1f}ms')
+
+
+class Metrics:
+    """Registry of the bot's counters and histograms. Modules register theirs at import time, like loggers."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Union[Counter, Histogram]] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines += metric.samples()
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        return '\n'.join(f'{name}: {metric.summary()}' for name, metric in self.metrics.items())
+
+    async def serve(self, port: int, host: str = '127.0.0.1'):
+        """Serve render() at http://host:port/metrics for a local Prometheus scraper"""
+        async def handle(request):
+            return web.Response(text=self.render(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+        return runner
+
+
+metrics = Metrics()
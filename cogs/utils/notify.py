@@ -0,0 +1,85 @@
+import asyncio
+from collections import defaultdict, deque
+import logging
+import time
+from typing import Awaitable, Callable, Deque, Dict, List, Tuple
+
+from cogs.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+send_seconds = metrics.histogram('discord_send_seconds', 'Seconds to send one message of alert embeds')
+queue_seconds = metrics.histogram('alert_queue_seconds', 'Seconds from an alert being queued to being sent')
+
+MAX_EMBEDS = 10  # discord's limit on embeds per message
+MAX_EMBED_CHARS = 6000  # and on the combined text of a message's embeds
+
+
+def embed_chars(embed: dict) -> int:
+    return (len(embed.get('title', '')) + len(embed.get('description', ''))
+            + len(embed.get('footer', {}).get('text', '')) + len(embed.get('author', {}).get('name', ''))
+            + sum(len(field.get('name', '')) + len(field.get('value', '')) for field in embed.get('fields', ())))
+
+
+class Notifier:
+    """Outbound queue of embeds per channel.
+
+    post() only queues, so the alert loop never waits on discord. Each channel with something queued has one
+    worker task that sends its embeds in order, packing everything queued while the previous message was in
+    flight into as few messages as the embed limits allow. Rate limits are per channel buckets, which the send
+    function (discord.py's HTTPClient) waits out, so a throttled channel only holds up its own worker.
+    """
+
+    def __init__(self, send: Callable[[int, List[dict]], Awaitable], max_pending: int = 10000):
+        self.send = send  # (channel id, embeds) -> one message
+        self.max_pending = max_pending
+        self.pending: Dict[int, Deque[Tuple[float, dict]]] = defaultdict(deque)  # (time queued, embed)
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.sent = 0
+        self.messages = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def post(self, channel_id: int, embed: dict):
+        queue = self.pending[channel_id]
+        queue.append((time.perf_counter(), embed))
+        if len(queue) > self.max_pending:
+            queue.popleft()
+            self.dropped += 1
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.ensure_future(self.drain(channel_id))
+
+    def batch(self, queue: Deque[Tuple[float, dict]]) -> List[Tuple[float, dict]]:
+        batch = [queue.popleft()]
+        chars = embed_chars(batch[0][1])
+        while queue and len(batch) < MAX_EMBEDS and chars + embed_chars(queue[0][1]) <= MAX_EMBED_CHARS:
+            chars += embed_chars(queue[0][1])
+            batch.append(queue.popleft())
+        return batch
+
+    async def drain(self, channel_id: int):
+        queue = self.pending[channel_id]
+        try:
+            while queue:
+                queued, embeds = zip(*self.batch(queue))
+                start = time.perf_counter()
+                try:
+                    await self.send(channel_id, list(embeds))
+                    end = time.perf_counter()
+                    send_seconds.observe(end - start)
+                    for at in queued:
+                        queue_seconds.observe(end - at)
+                    self.sent += len(embeds)
+                    self.messages += 1
+                except Exception as e:
+                    self.failures += len(embeds)
+                    logger.error(f'Could not send {len(embeds)} alerts to {channel_id}: {e}')
+        finally:
+            del self.workers[channel_id]
+            if not queue:
+                del self.pending[channel_id]
+
+    async def wait(self):
+        """Wait until everything queued so far has been sent"""
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
@@ -0,0 +1,50 @@
+from typing import Callable, Dict, Hashable, List, Sequence, Tuple
+
+MESSAGE_LIMIT = 2000  # discord's limit on message content
+
+
+class Listing:
+    """A book of items shown a page at a time.
+
+    Pages are rendered on demand and kept until the book's version changes, so showing a page of a 10,000 item
+    book renders the same 20 lines as a 20 item book, and paging back and forth renders nothing.
+    """
+
+    def __init__(self, items: Callable[[], Sequence], version: Callable[[], Hashable],
+                 line: Callable[[int, object], str], empty: str, per_page: int = 20):
+        self.items = items
+        self.version = version
+        self.line = line  # (position, item) -> line of text
+        self.empty = empty
+        self.per_page = per_page
+        self.snapshot: List = []
+        self.snapshot_version = None
+        self.rendered: Dict[int, str] = {}
+
+    def refresh(self):
+        version = self.version()
+        if version != self.snapshot_version:
+            self.snapshot = list(self.items())
+            self.snapshot_version = version
+            self.rendered = {}
+
+    @property
+    def count(self) -> int:
+        self.refresh()
+        return max(1, -(-len(self.snapshot) // self.per_page))
+
+    def page(self, number: int) -> Tuple[str, int]:
+        """Text of a page and its number, clamped to the pages that exist"""
+        number = min(max(number, 0), self.count - 1)
+        text = self.rendered.get(number)
+        if text is None:
+            start = number * self.per_page
+            lines = [self.line(position, item) for position, item
+                     in enumerate(self.snapshot[start:start + self.per_page], start)]
+            text = '\n'.join(lines) or self.empty
+            footer = f'\nPage {number + 1}/{self.count}' if self.count > 1 else ''
+            if len(text) + len(footer) > MESSAGE_LIMIT:
+                text = text[:MESSAGE_LIMIT - len(footer) - 1] + '…'
+            text += footer
+            self.rendered[number] = text
+        return text, number
@@ -0,0 +1,98 @@
+import math
+from typing import Dict, Iterable, Iterator, List
+
+from cogs.utils.lazy import lazy_import
+from cogs.utils.records import Record
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+class Holding(Record):
+    """A ticker's position, kept as running totals that each trade updates in O(1).
+
+    Cost basis is at average cost: a trade that adds to the position adds its cost, one that reduces it takes
+    out its share of the average cost and realizes the difference to its price. So realized P&L is fixed once
+    a sale happens, and later buys only move the average cost of what is still held. A trade that goes past
+    zero closes the position and opens one the other way (a short) with the rest.
+    """
+    ticker: str = ''
+    amount: float = 0
+    cost_basis: float = 0
+    realized: float = 0
+
+    @property
+    def average_cost(self) -> float:
+        return self.cost_basis / self.amount if self.amount else 0.0
+
+    def trade(self, shares: float, price: float):
+        """Apply a trade of shares (negative for a sale) at price"""
+        if self.amount and (self.amount > 0) != (shares > 0):
+            closed = math.copysign(min(abs(shares), abs(self.amount)), shares)
+            average = self.average_cost
+            self.realized += closed * (average - price)
+            self.cost_basis += closed * average
+            self.amount += closed
+            shares -= closed
+            if not self.amount:
+                self.cost_basis = 0.0  # drop rounding left over from the average
+        self.amount += shares
+        self.cost_basis += shares * price
+
+
+class Portfolio:
+    """Per ticker holdings, updated one trade at a time and only rebuilt from the whole trade log on load"""
+
+    def __init__(self, trades: Iterable = ()):
+        self.holdings: Dict[str, Holding] = {}
+        self.trades: List = []  # in the order they were applied
+        self.version = 0  # bumped on every trade
+        self.rebuild(trades)
+
+    def __len__(self):
+        return len(self.holdings)
+
+    def __iter__(self) -> Iterator[Holding]:
+        return iter(self.holdings.values())
+
+    def get(self, ticker: str) -> Holding:
+        return self.holdings.get(ticker.upper())
+
+    def open(self) -> List[Holding]:
+        return [holding for holding in self.holdings.values() if holding.amount]
+
+    def apply(self, trade) -> Holding:
+        ticker = trade.ticker.upper()
+        holding = self.holdings.get(ticker)
+        if holding is None:
+            holding = self.holdings[ticker] = Holding(ticker=ticker)
+        holding.trade(-trade.shares if trade.sell else trade.shares, trade.share_price)
+        self.trades.append(trade)
+        self.version += 1
+        return holding
+
+    def rebuild(self, trades: Iterable):
+        """Replay every trade in order, a position depends on the order of its buys and sells"""
+        self.holdings = {}
+        self.trades = []
+        self.version += 1
+        for trade in trades:
+            self.apply(trade)
+
+
+def valuation(holdings: Iterable[Holding], quotes: Dict[str, float]) -> 'pd.DataFrame':
+    """Market value and unrealized P&L of each holding at the quoted prices, NaN where there is no quote (or no
+    cost basis, for the change)"""
+    holdings = list(holdings)
+    table = pd.DataFrame({
+        'amount': [holding.amount for holding in holdings],
+        'cost_basis': [holding.cost_basis for holding in holdings],
+        'realized': [holding.realized for holding in holdings],
+    }, index=pd.Index([holding.ticker for holding in holdings], name='ticker'))
+    table['price'] = pd.Series(quotes, dtype=float).reindex(table.index)
+    table['value'] = table['amount'] * table['price']
+    table['unrealized'] = table['value'] - table['cost_basis']
+    # NaN instead of inf where nothing was paid, a free or fully closed position has no percentage change
+    cost = table['cost_basis'].abs()
+    table['change'] = np.where(cost != 0, table['unrealized'] / cost.where(cost != 0, 1.0), np.nan)
+    return table
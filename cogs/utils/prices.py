@@ -0,0 +1,146 @@
+import asyncio
+import threading
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from cogs.utils.cache import PriceCache, price_cache
+from cogs.utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+yf = lazy_import('yfinance')
+
+# yf.download collects results in module level dicts (yfinance.shared), so two batch downloads running on
+# different executor threads would clobber each other's frames
+_download_lock = threading.Lock()
+
+
+def download(tickers: str, **kwargs):
+    symbols = tickers.split()
+    if len(symbols) == 1:
+        # Ticker.history doesn't share state between calls, so single ticker downloads can run concurrently
+        kwargs.pop('group_by', None)
+        kwargs.pop('progress', None)
+        return yf.Ticker(symbols[0]).history(auto_adjust=False, actions=False, **kwargs)
+    with _download_lock:
+        return yf.download(tickers, **kwargs)
+
+
+def split(data: 'pd.DataFrame', tickers: Iterable[str]) -> Dict[str, 'pd.DataFrame']:
+    """Split a group_by='ticker' download into one frame per ticker.
+
+    yfinance only returns the (ticker, column) MultiIndex when more than one ticker is requested, and pads
+    every ticker onto a shared index, so the padding is dropped here.
+    """
+    frames = {}
+    for ticker in tickers:
+        try:
+            frame = data[ticker] if data.columns.nlevels > 1 else data
+        except KeyError:
+            continue
+        frame = frame.dropna(how='all')
+        if len(frame) > 0:
+            frames[ticker] = frame
+    return frames
+
+
+def history(tickers: Iterable[str], period: str, interval: str, prepost: bool = False,
+            cache: PriceCache = price_cache) -> Dict[str, 'pd.DataFrame']:
+    """Per ticker OHLC frames, read through the price cache.
+
+    Blocking. Tickers missing from the cache are fetched together in a single download. Tickers yahoo has no
+    data for are left out of the result.
+    """
+    tickers = sorted(set(ticker.upper() for ticker in tickers))
+    frames = {}
+    missing = []
+    for ticker in tickers:
+        frame = cache.get((ticker, period, interval, prepost))
+        if frame is None:
+            missing.append(ticker)
+        else:
+            frames[ticker] = frame
+
+    if missing:
+        data = download(' '.join(missing),
+                        period=period,
+                        interval=interval,
+                        group_by='ticker',
+                        prepost=prepost)
+        for ticker, frame in split(data, missing).items():
+            cache.put((ticker, period, interval, prepost), frame)
+            frames[ticker] = frame
+    return frames
+
+
+class SingleFlight:
+    """Lets concurrent callers asking for the same key share a single in flight future"""
+
+    def __init__(self):
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def claim(self, keys: Iterable[Hashable]) -> Tuple[List[Hashable], Dict[Hashable, asyncio.Future]]:
+        """Split keys into the ones the caller now owns and must resolve, and futures for ones already in flight"""
+        owned, waiting = [], {}
+        loop = asyncio.get_event_loop()
+        for key in keys:
+            future = self.inflight.get(key)
+            if future is None:
+                self.inflight[key] = loop.create_future()
+                owned.append(key)
+            else:
+                waiting[key] = future
+                self.coalesced += 1
+        return owned, waiting
+
+    def resolve(self, key: Hashable, value=None, error: Optional[BaseException] = None):
+        future = self.inflight.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+            future.exception()  # nobody may be waiting, don't log it as never retrieved
+
+
+class PriceService:
+    """Async price history shared by the alert loop and the commands.
+
+    Reads through the price cache and coalesces concurrent requests for the same (ticker, period, interval,
+    prepost) key, so a burst of lookups for one ticker while the loop is already fetching it costs one download.
+    """
+
+    def __init__(self, io, cache: PriceCache = price_cache):
+        self.io = io
+        self.cache = cache
+        self.flights = SingleFlight()
+
+    async def history(self, tickers: Iterable[str], period: str, interval: str,
+                      prepost: bool = False) -> Dict[str, 'pd.DataFrame']:
+        frames = {}
+        keys = []
+        for ticker in sorted(set(ticker.upper() for ticker in tickers)):
+            frame = self.cache.get((ticker, period, interval, prepost))
+            if frame is None:
+                keys.append((ticker, period, interval, prepost))
+            else:
+                frames[ticker] = frame
+        owned, waiting = self.flights.claim(keys)
+
+        if owned:
+            try:
+                downloaded = await self.io.run(history, [key[0] for key in owned], period, interval, prepost,
+                                               self.cache)
+            except BaseException as e:
+                for key in owned:
+                    self.flights.resolve(key, error=e)
+                raise
+            for key in owned:
+                self.flights.resolve(key, downloaded.get(key[0]))
+            frames.update(downloaded)
+
+        for (ticker, *_), future in waiting.items():
+            frame = await future
+            if frame is not None:
+                frames[ticker] = frame
+        return frames
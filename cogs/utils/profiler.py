@@ -0,0 +1,81 @@
+import collections
+import logging
+import sys
+import threading
+import time
+from typing import Counter, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread every interval seconds.
+
+    Nothing is hooked into the sampled thread, so it costs nothing until start() and only the sampler's share
+    of the GIL while running. Stacks are counted in collapsed form (root;...;leaf), which flamegraph.pl and
+    speedscope read directly.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter[Tuple[str, ...]] = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self.stopped = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped = time.time()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_globals.get("__name__", "?")}.{frame.f_code.co_name}')
+                frame = frame.f_back
+            del frame
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in self.stacks.most_common())
+
+    def write(self, file_name: str):
+        with open(file_name, 'w') as f:
+            f.write(self.collapsed())
+
+    def top(self, n: int = 10) -> List[Tuple[str, int, int]]:
+        """(function, self samples, total samples) of the n functions with the most self samples"""
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        return [(function, count, total[function]) for function, count in own.most_common(n)]
+
+    def summary(self, n: int = 10) -> str:
+        if not self.samples:
+            return 'No samples'
+        lines = [f'{self.samples} samples over {(self.stopped or time.time()) - self.started:.1f}s',
+                 '  self  total  function']
+        for function, own, total in self.top(n):
+            lines.append(f'{100 * own / self.samples:5.1f}% {100 * total / self.samples:5.1f}%  {function}')
+        return '\n'.join(lines)
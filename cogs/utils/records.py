@@ -0,0 +1,170 @@
+import sys
+import typing
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _optional(convert: Callable) -> Callable:
+    return lambda value: None if value is None else convert(value)
+
+
+def _intern(value) -> str:
+    return sys.intern(str(value))
+
+
+CONVERTERS = {str: _intern, float: float, int: int, bool: bool}
+
+
+def _converter(annotation) -> Optional[Callable]:
+    if typing.get_origin(annotation) is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        convert = CONVERTERS.get(args[0]) if len(args) == 1 else None
+        return None if convert is None else _optional(convert)
+    return CONVERTERS.get(annotation)
+
+
+class RecordMeta(type):
+    """Builds slotted record types from a dataclass style class body.
+
+    Every annotated attribute becomes a slot and needs a default. Transient fields, given as a class keyword,
+    get a slot and their default on creation but are left out of the constructor, comparisons, repr and pickles.
+    """
+
+    def __new__(mcs, name, bases, namespace, transient: Sequence[str] = ()):
+        annotations = namespace.get('__annotations__', {})
+        if bases:
+            defaults = {field: namespace.pop(field) for field in annotations}
+            namespace['__slots__'] = tuple(annotations)
+            namespace['_fields'] = tuple(field for field in annotations if field not in transient)
+            namespace['_transient'] = tuple(transient)
+            namespace['_defaults'] = defaults
+            namespace['_converters'] = {field: convert for field, convert in
+                                        ((field, _converter(annotation)) for field, annotation in annotations.items())
+                                        if convert is not None}
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class Record(metaclass=RecordMeta):
+    """Base for slotted, fixed field record types.
+
+    Field values are normalized on assignment: numeric fields become native floats/ints/bools (so numpy scalars
+    taken from price frames aren't stored or pickled) and string fields are interned.
+    """
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _transient: Tuple[str, ...] = ()
+    _defaults: Dict[str, Any] = {}
+    _converters: Dict[str, Callable] = {}
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self._fields):
+            raise TypeError(f'{type(self).__name__} takes at most {len(self._fields)} positional arguments')
+        values = dict(zip(self._fields, args))
+        for name, value in kwargs.items():
+            if name not in self._defaults or name in values:
+                raise TypeError(f'{type(self).__name__} got an unexpected or repeated argument {name}')
+            values[name] = value
+        for name in self._transient:
+            object.__setattr__(self, name, self._defaults[name])
+        for name in self._fields:
+            setattr(self, name, values.get(name, self._defaults[name]))
+
+    def __setattr__(self, name, value):
+        convert = self._converters.get(name)
+        object.__setattr__(self, name, value if convert is None else convert(value))
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self._fields)
+        return f'{type(self).__name__}({values})'
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def __setstate__(self, state):
+        for name in self._transient:
+            object.__setattr__(self, name, self._defaults[name])
+        # Pickles of the old dataclass versions carry an unnormalized __dict__ instead of a tuple
+        if isinstance(state, dict):
+            for name in self._fields:
+                Record.__setattr__(self, name, state.get(name, self._defaults[name]))
+            return
+        for name, value in zip(self._fields, state):
+            object.__setattr__(self, name, value)
+        # Fields added since the record was stored take their defaults
+        for name in self._fields[len(state):]:
+            object.__setattr__(self, name, self._defaults[name])
+
+
+class RecordArrays:
+    """Struct of arrays copy of a list of records of one type, used for bulk storage.
+
+    Numeric fields become numpy arrays (None stored as NaN or a mask) and string fields are dictionary encoded,
+    which loads faster than one pickled object per record.
+    """
+
+    def __init__(self, record_type: type, length: int, columns: Dict[str, Any]):
+        self.record_type = record_type
+        self.length = length
+        self.columns = columns
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def from_records(cls, records: Sequence[Record]) -> 'RecordArrays':
+        record_type = type(records[0])
+        columns = {}
+        for name in record_type._fields:
+            values = [getattr(record, name) for record in records]
+            if all(isinstance(value, str) for value in values):
+                uniques, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+                columns[name] = ('str', list(uniques), codes.astype(np.min_scalar_type(len(uniques))))
+            elif all(isinstance(value, bool) for value in values):
+                columns[name] = ('bool', np.array(values, dtype=bool))
+            elif all(value is None or isinstance(value, int) for value in values):
+                missing = np.array([value is None for value in values], dtype=bool)
+                columns[name] = ('int', np.array([0 if value is None else value for value in values],
+                                                 dtype=np.int64), missing if missing.any() else None)
+            elif all(value is None or isinstance(value, float) for value in values):
+                columns[name] = ('float', np.array([np.nan if value is None else value for value in values],
+                                                   dtype=np.float64))
+            else:
+                columns[name] = ('object', values)
+        return cls(record_type, len(records), columns)
+
+    def to_records(self) -> List[Record]:
+        columns = []
+        for name in self.record_type._fields:
+            if name not in self.columns:
+                # Added to the record type since the arrays were stored
+                columns.append([self.record_type._defaults[name]] * self.length)
+                continue
+            kind, *data = self.columns[name]
+            if kind == 'str':
+                uniques, codes = data
+                columns.append([uniques[code] for code in codes.tolist()])
+            elif kind == 'int':
+                values, missing = data
+                values = values.tolist()
+                columns.append(values if missing is None else
+                               [None if absent else value for value, absent in zip(values, missing.tolist())])
+            elif kind == 'float':
+                columns.append([None if value != value else value for value in data[0].tolist()])
+            else:
+                columns.append(list(data[0]) if kind == 'object' else data[0].tolist())
+
+        records = []
+        for state in zip(*columns):
+            item = self.record_type.__new__(self.record_type)
+            item.__setstate__(state)
+            records.append(item)
+        return records
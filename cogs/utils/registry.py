@@ -0,0 +1,113 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class AlertRegistry:
+    """Alerts keyed by a stable id, with secondary indexes by ticker, by alert type and by guild.
+
+    Per ticker and per guild operations only touch those alerts instead of the whole book. Alerts are iterated in
+    the order they were added. Secondary indexes are dicts used as ordered sets of ids. Alerts without a guild
+    (made before alerts were routed per guild) are indexed under default_guild.
+    """
+
+    def __init__(self, alerts: Iterable = (), default_guild: Optional[int] = None):
+        self.alerts: Dict[int, object] = {}
+        self.by_ticker: Dict[str, Dict[int, None]] = {}
+        self.by_type: Dict[str, Dict[int, None]] = {}
+        self.by_guild: Dict[Optional[int], Dict[int, None]] = {}
+        self.default_guild = default_guild
+        self.next_id = 1
+        self.version = 0  # bumped whenever alerts are added or removed
+
+        alerts = list(alerts)
+        self.next_id = max((alert.id for alert in alerts if alert.id is not None), default=0) + 1
+        for alert in alerts:
+            self.add(alert)
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.alerts.values())
+
+    def __contains__(self, alert_id: int):
+        return alert_id in self.alerts
+
+    def get(self, alert_id: int):
+        return self.alerts.get(alert_id)
+
+    def ticker(self, ticker: str) -> List:
+        return [self.alerts[alert_id] for alert_id in self.by_ticker.get(ticker.upper(), ())]
+
+    def of_type(self, alert_type: str) -> List:
+        return [self.alerts[alert_id] for alert_id in self.by_type.get(alert_type, ())]
+
+    def guild(self, guild_id: Optional[int]) -> List:
+        return [self.alerts[alert_id] for alert_id in self.by_guild.get(guild_id, ())]
+
+    def guild_of(self, alert) -> Optional[int]:
+        return self.default_guild if alert.guild_id is None else alert.guild_id
+
+    def add(self, alert):
+        if alert.id is None:
+            alert.id = self.next_id
+        self.next_id = max(self.next_id, alert.id + 1)
+        self.alerts[alert.id] = alert
+        self.by_ticker.setdefault(alert.ticker.upper(), {})[alert.id] = None
+        self.by_type.setdefault(alert.type, {})[alert.id] = None
+        self.by_guild.setdefault(self.guild_of(alert), {})[alert.id] = None
+        self.version += 1
+        return alert
+
+    def remove(self, alert_id: int) -> Optional[object]:
+        alert = self.alerts.pop(alert_id, None)
+        if alert is not None:
+            self._unindex(self.by_ticker, alert.ticker.upper(), alert_id)
+            self._unindex(self.by_type, alert.type, alert_id)
+            self._unindex(self.by_guild, self.guild_of(alert), alert_id)
+            self.version += 1
+        return alert
+
+    def remove_ticker(self, ticker: str, guild_id: Optional[int] = None) -> List:
+        """Remove a ticker's alerts, only those in guild_id if given"""
+        ids = self.by_ticker.get(ticker.upper(), ())
+        if guild_id is not None:
+            ids = [alert_id for alert_id in ids if self.guild_of(self.alerts[alert_id]) == guild_id]
+        return [self.remove(alert_id) for alert_id in list(ids)]
+
+    def clear(self, guild_id: Optional[int] = None):
+        """Remove every alert, only those in guild_id if given"""
+        if guild_id is not None:
+            for alert_id in list(self.by_guild.get(guild_id, ())):
+                self.remove(alert_id)
+            return
+        self.alerts.clear()
+        self.by_ticker.clear()
+        self.by_type.clear()
+        self.by_guild.clear()
+        self.version += 1
+
+    def apply(self, record):
+        """Apply a journal record, (seq, op, *args), written by the alert commands"""
+        _, op, *args = record
+        if op == 'add':
+            self.add(args[0])
+        elif op == 'remove':
+            self.remove(args[0])
+        elif op == 'remove_ticker':
+            self.remove_ticker(*args)
+        elif op == 'clear':
+            self.clear(*args)
+        elif op == 'set':
+            alert_id, field, value = args
+            if alert_id in self.alerts:
+                setattr(self.alerts[alert_id], field, value)
+        else:
+            raise ValueError(f'Unknown alert journal op {op}')
+
+    @staticmethod
+    def _unindex(index: Dict, key, alert_id: int):
+        ids = index.get(key)
+        if ids is not None:
+            ids.pop(alert_id, None)
+            if not ids:
+                del index[key]
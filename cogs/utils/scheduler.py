@@ -0,0 +1,102 @@
+import heapq
+import logging
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pytz
+
+from cogs.utils.markets import MarketCalendar, calendar as market_calendar
+
+logger = logging.getLogger(__name__)
+
+QuoteKey = Tuple[str, str, bool]  # (ticker, period, prepost)
+
+# Seconds per bar, the fastest a quote on that bar size can usefully be polled
+BAR_SECONDS = {
+    '1m': 60,
+    '2m': 2 * 60,
+    '5m': 5 * 60,
+    '15m': 15 * 60,
+    '30m': 30 * 60,
+    '60m': 60 * 60,
+    '90m': 90 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60,
+}
+
+
+class PollScheduler:
+    """Priority queue of when each quote is next due to be polled.
+
+    The cadence of a quote starts at its bar size (capped at max_seconds) and is then scaled by recent
+    volatility: a quote that barely moved between polls waits up to max_factor times longer, one moving faster
+    than target_volatility per poll is polled down to min_seconds. Quotes on closed markets are due at the next
+    session open.
+    """
+
+    def __init__(self, intervals: Dict[str, str], calendar: MarketCalendar = market_calendar,
+                 min_seconds: float = 60, max_seconds: float = 15 * 60, max_factor: float = 4,
+                 target_volatility: float = 0.002, smoothing: float = 0.3):
+        self.intervals = intervals
+        self.calendar = calendar
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.max_factor = max_factor
+        self.target_volatility = target_volatility
+        self.smoothing = smoothing
+
+        self.heap: List[Tuple[float, QuoteKey]] = []
+        self.due: Dict[QuoteKey, float] = {}
+        self.volatility: Dict[QuoteKey, float] = {}
+        self.last_price: Dict[QuoteKey, float] = {}
+
+    def __len__(self):
+        return len(self.due)
+
+    def sync(self, keys: Iterable[QuoteKey], now: float):
+        """Track exactly keys: new ones are due immediately, dropped ones are forgotten"""
+        keys = set(keys)
+        for key in keys - self.due.keys():
+            self._push(key, now)
+        for key in self.due.keys() - keys:
+            del self.due[key]
+            self.volatility.pop(key, None)
+            self.last_price.pop(key, None)
+
+    def pop_due(self, now: float) -> List[QuoteKey]:
+        keys = []
+        while self.heap and self.heap[0][0] <= now:
+            due, key = heapq.heappop(self.heap)
+            # Entries for keys that were dropped or rescheduled are left in the heap and skipped here
+            if self.due.get(key) == due:
+                del self.due[key]
+                keys.append(key)
+        return keys
+
+    def observe(self, key: QuoteKey, price: Optional[float], now: float):
+        """Record the price a polled quote returned (None if the poll failed) and schedule its next poll"""
+        previous = self.last_price.get(key)
+        if price is not None and previous:
+            change = abs(price / previous - 1)
+            self.volatility[key] = self.smoothing * change + (1 - self.smoothing) * self.volatility.get(key, change)
+        if price is not None:
+            self.last_price[key] = price
+        self._push(key, now + self.cadence(key, now))
+
+    def cadence(self, key: QuoteKey, now: float) -> float:
+        ticker, period, prepost = key
+        at = datetime.fromtimestamp(now, tz=pytz.utc)
+        if not self.calendar.is_open(ticker, prepost, at):
+            return max(self.min_seconds, (self.calendar.next_open(ticker, prepost, at) - at).total_seconds())
+
+        base = min(BAR_SECONDS.get(self.intervals.get(period), self.min_seconds), self.max_seconds)
+        volatility = self.volatility.get(key)
+        if volatility is None:
+            return base
+        factor = self.target_volatility / volatility if volatility > 0 else math.inf
+        return max(self.min_seconds, min(base * factor, base * self.max_factor))
+
+    def _push(self, key: QuoteKey, due: float):
+        self.due[key] = due
+        heapq.heappush(self.heap, (due, key))
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, Optional, Set
+
+from cogs.utils.executor import IOExecutor
+from cogs.utils.lazy import lazy_import
+from cogs.utils.metrics import metrics
+
+boto3 = lazy_import('boto3')
+botocore_config = lazy_import('botocore.config')
+s3_transfer = lazy_import('boto3.s3.transfer')
+
+logger = logging.getLogger(__name__)
+
+upload_seconds = metrics.histogram('upload_seconds', 'Seconds to upload a state file to storage')
+upload_failures = metrics.counter('upload_failures_total', 'State file uploads that failed')
+
+
+class Storage:
+    """Where state files are kept between restarts. Files are addressed by their local file name."""
+
+    def upload(self, file_name: str):
+        raise NotImplementedError
+
+    def download(self, file_name: str) -> bool:
+        """Copy the stored file to file_name. Returns False if there is no stored copy."""
+        raise NotImplementedError
+
+
+class S3Storage(Storage):
+    """Long lived s3 client shared by every upload and download.
+
+    boto3 clients are thread safe, so the executor threads share one connection pool instead of each call
+    resolving credentials and opening a new TLS connection. Large files are sent as concurrent multipart uploads.
+    The client (and boto3 itself) is only created by the first transfer, which runs on an executor thread.
+    """
+
+    def __init__(self, bucket: str, access_key_id: str, access_key: str, max_connections: int = 10,
+                 endpoint_url: Optional[str] = None):
+        self.bucket = bucket
+        self.access_key_id = access_key_id
+        self.access_key = access_key
+        self.max_connections = max_connections
+        self.endpoint_url = endpoint_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                config = botocore_config.Config(max_pool_connections=self.max_connections,
+                                                retries={'max_attempts': 5, 'mode': 'standard'})
+                self._client = boto3.client('s3',
+                                            aws_access_key_id=self.access_key_id,
+                                            aws_secret_access_key=self.access_key,
+                                            endpoint_url=self.endpoint_url,
+                                            config=config)
+                self.transfer = s3_transfer.TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=4)
+            return self._client
+
+    def upload(self, file_name: str):
+        client = self.client
+        client.upload_file(file_name, self.bucket, file_name, Config=self.transfer)
+
+    def download(self, file_name: str) -> bool:
+        client = self.client
+        try:
+            client.download_file(self.bucket, file_name, file_name, Config=self.transfer)
+        except client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+
+class LocalStorage(Storage):
+    """Keeps copies of the state files in a local directory, for running without s3"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, file_name: str):
+        shutil.copyfile(file_name, os.path.join(self.directory, os.path.basename(file_name)))
+
+    def download(self, file_name: str) -> bool:
+        path = os.path.join(self.directory, os.path.basename(file_name))
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, file_name)
+        return True
+
+
+class MemoryStorage(Storage):
+    """Keeps the state files in a dict, for tests and benchmarks"""
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = {}
+
+    def upload(self, file_name: str):
+        with open(file_name, 'rb') as f:
+            self.objects[file_name] = f.read()
+
+    def download(self, file_name: str) -> bool:
+        if file_name not in self.objects:
+            return False
+        with open(file_name, 'wb') as f:
+            f.write(self.objects[file_name])
+        return True
+
+
+def storage_from_env() -> Storage:
+    """STORAGE selects the backend: s3 (default, or any s3 compatible endpoint via S3_ENDPOINT), local or memory"""
+    backend = os.environ.get('STORAGE', 's3')
+    if backend == 's3':
+        return S3Storage(os.environ['S3_BUCKET'],
+                         os.environ['ACCESS_KEY_ID'],
+                         os.environ['ACCESS_KEY'],
+                         endpoint_url=os.environ.get('S3_ENDPOINT'))
+    if backend == 'local':
+        return LocalStorage(os.environ.get('STORAGE_DIR', 'storage'))
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f'Unknown storage backend {backend}')
+
+
+class Uploader:
+    """Fire and forget uploads that are still tracked.
+
+    Each file has at most one upload in flight. If the file is uploaded again while that is running, it is
+    re-sent once the current upload finishes, so an older copy can never land after a newer one. Files that
+    failed are passed to retry, if given, so storage isn't left with a stale copy until the file changes again.
+    """
+
+    def __init__(self, storage: Storage, io: IOExecutor, retry: Optional[Callable[[str], None]] = None):
+        self.storage = storage
+        self.io = io
+        self.retry = retry
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.again: Set[str] = set()
+        self.failed: Set[str] = set()  # files whose last upload didn't land
+        self.failures = 0
+
+    def upload(self, file_name: str):
+        if not os.path.exists(file_name):
+            # Nothing written yet, like a snapshot before the first compaction
+            return
+        if file_name in self.inflight:
+            self.again.add(file_name)
+            return
+        future = asyncio.ensure_future(self.io.run(self.storage.upload, file_name))
+        self.inflight[file_name] = future
+        future.add_done_callback(partial(self._done, file_name, time.perf_counter()))
+
+    def _done(self, file_name: str, start: float, future: asyncio.Future):
+        del self.inflight[file_name]
+        upload_seconds.observe(time.perf_counter() - start)
+        if future.cancelled():
+            self.failed.add(file_name)
+        elif future.exception() is not None:
+            self.failed.add(file_name)
+            self.failures += 1
+            upload_failures.inc()
+            logger.error(f'Could not save {file_name}: {future.exception()}')
+            if self.retry is not None and file_name not in self.again:
+                self.retry(file_name)
+        else:
+            self.failed.discard(file_name)
+        if file_name in self.again:
+            self.again.discard(file_name)
+            self.upload(file_name)
+
+    async def sync(self, file_name: str) -> bool:
+        """Upload file_name as it is now and wait for it to land. Returns whether it did."""
+        if not os.path.exists(file_name):
+            return False
+        self.upload(file_name)
+        # Loops when an upload already in flight was followed by this one
+        while file_name in self.inflight:
+            await asyncio.gather(self.inflight[file_name], return_exceptions=True)
+        return file_name not in self.failed
+
+    async def wait(self):
+        while self.inflight:
+            await asyncio.gather(*self.inflight.values(), return_exceptions=True)
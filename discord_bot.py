@@ -1,7 +1,6 @@
 from typing import List, Any, Optional
 from discord.ext import commands, tasks
 import discord
-import yfinance as yf
 from dataclasses import dataclass
 from datetime import datetime
 import pickle
@@ -11,6 +10,8 @@ import argparse
 import logging
 from discord_slash import SlashCommand, SlashContext
 from discord_slash.utils.manage_commands import create_option, create_choice
+from cogs.utils.portfolio import Holding as Position
+from cogs.utils.prices import history
 
 logging.basicConfig(level=logging.INFO)
 
@@ -142,11 +143,10 @@ async def check_stocks():
     channel = client.get_channel(821841802796859406)
     for alert in alerts:
         try:
-            data = yf.download(alert.ticker, period='1d', interval='1m')
+            close = history([alert.ticker], period='1d', interval='1m')[alert.ticker.upper()]['Close']
         except:
             continue
 
-        close = data['Close']
         if close.index[-1].date() != datetime.now().date():
             alert.last_alert = None
             continue
@@ -183,8 +183,7 @@ async def get_stock(ctx, *args):
     ticker = args[0]
 
     try:
-        data = yf.download(ticker, period='1d', interval='1m')
-        close = data['Close']
+        close = history([ticker], period='1d', interval='1m')[ticker.upper()]['Close']
 
         em = discord.Embed(colour=0x0080c0,
                            description=f'[{ticker}](https://finance.yahoo.com/quote/{ticker}) is ${round(close[-1], 2)}')
@@ -242,13 +241,13 @@ async def sell(ctx, *args):
 
 
 def holdings(trades: List[Trade]) -> List[Holding]:
-    tickers = set([trade.ticker for trade in trades])
-
-    for ticker in tickers:
-        ticker_trades = [trade for trade in trades if trade.ticker == ticker]
-
-        amount = sum([t.amount for t in ticker_trades if not t.sell]) - sum(
-            [t.amount for t in ticker_trades if not t.sell])
+    positions = {}
+    for trade in trades:
+        ticker = trade.ticker.upper()
+        position = positions.setdefault(ticker, Position(ticker=ticker))
+        position.trade(-trade.amount if trade.sell else trade.amount, trade.price)
+    return [Holding(ticker, position.amount, position.cost_basis)
+            for ticker, position in positions.items() if position.amount]
 
 
 @commands.command(aliases=['Positions'])